@@ -0,0 +1,577 @@
+"""Load-tests the bot's commands offline, without Discord or YouTube.
+
+``--guilds`` fake guilds with ``--users`` members each run a random mix
+of commands (!play, !queue, !skip, !give, !buy, !timely) and voice
+channel moves through the real command callbacks, checks and hooks.
+Discord is replaced by in-memory guilds, channels and members, voice by
+a client that plays frames at real-time pace on its own thread like
+discord.py's does, ffmpeg by a silent source and youtube-dl by a stub
+that answers after ``--latency`` (+/- ``--jitter``) seconds.
+
+Reported are commands per second, p50/p99 latency per command, how long
+the event loop was blocked, and memory, as JSON. ``--output`` keeps the
+results, ``--baseline`` compares against ones kept earlier.
+
+    python bench/load.py --guilds 50 --users 20 --commands 30 --output before.json
+    python bench/load.py --guilds 50 --users 20 --commands 30 --baseline before.json
+
+Needs the resource module (so not Windows).
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import discord
+from discord.ext import commands
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+DEFAULT_MIX = 'play=30,queue=20,skip=10,give=15,buy=5,timely=10,voice=10'
+
+
+class StubYoutubeDL:
+    """Answers extract_info like youtube-dl would, after a simulated network delay."""
+
+    latency = 0.3
+    jitter = 0.1
+
+    def __init__(self, params: dict = None):
+        self.params = dict(params or {})
+
+    def extract_info(self, url: str, download: bool = False, process: bool = True):
+        time.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+        video_id = format(abs(hash(url)) % 16 ** 11, '011x')
+        webpage_url = url if '://' in url else 'https://bench.invalid/watch?v=' + video_id
+        if not process:
+            return {'entries': [{'title': url, 'webpage_url': webpage_url}]}
+
+        return {
+            'title': 'Track ' + video_id,
+            'webpage_url': webpage_url,
+            'uploader': 'bench',
+            'uploader_url': 'https://bench.invalid/bench',
+            'duration': 180,
+            'thumbnail': 'https://bench.invalid/{}.jpg'.format(video_id),
+            'url': 'https://bench.invalid/stream/{}?expire={}'.format(video_id, int(time.time()) + 6 * 60 * 60),
+            'acodec': 'opus',
+        }
+
+
+class SilentAudio:
+    """Stands in for ffmpeg: hands out ``frames`` frames of silence."""
+
+    frames = 150
+    frame = b'\0' * 3840
+
+    def __init__(self, source: str, **options):
+        self.source = source
+        self.remaining = self.frames
+
+    def read(self):
+        if self.remaining <= 0:
+            return b''
+        self.remaining -= 1
+        return self.frame
+
+    def is_opus(self):
+        return False
+
+    def cleanup(self):
+        self.remaining = 0
+
+
+class SilentOpusAudio(SilentAudio):
+    frame = b'\xf8\xff\xfe'
+
+    def is_opus(self):
+        return True
+
+
+class FakeMessage:
+    _ids = iter(range(1 << 40, 1 << 41))
+    _state = None
+
+    def __init__(self, channel, author, content: str = None, embed=None):
+        self.id = next(self._ids)
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embed = embed
+        self.mentions = []
+
+    async def edit(self, *, content: str = None, embed=None):
+        self.content = content if content is not None else self.content
+        self.embed = embed if embed is not None else self.embed
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def remove_reaction(self, emoji, member):
+        pass
+
+    async def clear_reactions(self):
+        pass
+
+
+class FakeTyping:
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+
+class FakeTextChannel:
+    def __init__(self, guild, channel_id: int, name: str):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.sent = 0
+
+    async def send(self, content: str = None, *, embed=None, **kwargs):
+        self.sent += 1
+        return FakeMessage(self, self.guild.me, content, embed)
+
+    def typing(self):
+        return FakeTyping()
+
+    def permissions_for(self, member):
+        return discord.Permissions.all()
+
+
+class BenchContext(commands.Context):
+    async def send(self, content: str = None, **kwargs):
+        return await self.channel.send(content, **kwargs)
+
+    def typing(self):
+        return self.channel.typing()
+
+
+class FakeVoiceChannel:
+    def __init__(self, guild, channel_id: int, name: str, *, category=None):
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+        self.category = category
+        self.members = []
+
+    async def connect(self):
+        self.guild.voice_client = FakeVoiceClient(self)
+        return self.guild.voice_client
+
+    async def delete(self):
+        self.guild.channels.pop(self.id, None)
+
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class FakeVoiceClient:
+    """Plays sources like discord.py's AudioPlayer: a thread reads a frame every 20 ms."""
+
+    def __init__(self, channel: FakeVoiceChannel):
+        self.channel = channel
+        self.loop = asyncio.get_event_loop()
+        self.source = None
+        self._connected = True
+        self._player = None
+        self._stopped = threading.Event()
+        self._paused = False
+
+    def is_connected(self):
+        return self._connected
+
+    def is_playing(self):
+        return self._player is not None and self._player.is_alive() and not self._paused
+
+    def is_paused(self):
+        return self._paused
+
+    def play(self, source, *, after=None):
+        if self.is_playing():
+            raise RuntimeError('Already playing audio.')
+
+        self.source = source
+        self._stopped = threading.Event()
+        self._player = threading.Thread(target=self._play, args=(source, after, self._stopped), daemon=True)
+        self._player.start()
+
+    def _play(self, source, after, stopped: threading.Event):
+        deadline = time.perf_counter()
+        while not stopped.is_set():
+            if not self._paused and not source.read():
+                break
+            deadline += 0.02
+            stopped.wait(max(deadline - time.perf_counter(), 0))
+
+        if after is not None:
+            self.loop.call_soon_threadsafe(after, None)
+
+    def stop(self):
+        self._stopped.set()
+
+    def pause(self):
+        self._paused = True
+
+    def resume(self):
+        self._paused = False
+
+    async def move_to(self, channel: FakeVoiceChannel):
+        self.channel = channel
+
+    async def disconnect(self):
+        self.stop()
+        self._connected = False
+        if self.channel.guild.voice_client is self:
+            self.channel.guild.voice_client = None
+
+
+class FakeRole:
+    def __init__(self, guild, role_id: int, name: str):
+        self.guild = guild
+        self.id = role_id
+        self.name = name
+        self.mention = '<@&{}>'.format(role_id)
+
+
+class FakeMember:
+    def __init__(self, guild, user_id: int, name: str, *, bot: bool = False):
+        self.guild = guild
+        self.id = user_id
+        self.name = self.display_name = name
+        self.mention = '<@{}>'.format(user_id)
+        self.bot = bot
+        self.roles = []
+        self.voice = None
+
+    def __str__(self):
+        return self.name + '#0001'
+
+    async def add_roles(self, *roles):
+        self.roles.extend(roles)
+
+    async def move_to(self, channel: FakeVoiceChannel):
+        # The gateway would echo the move as a voice state update; here
+        # the bot's handler runs right away.
+        before = self.voice
+        self.move(channel)
+        await self.guild.bench.bot_module.on_voice_state_update(self, before, self.voice)
+
+    def move(self, channel: FakeVoiceChannel):
+        if self.voice is not None:
+            self.voice.channel.members.remove(self)
+        self.voice = FakeVoiceState(channel) if channel is not None else None
+        if channel is not None:
+            channel.members.append(self)
+
+
+class FakeGuild:
+    def __init__(self, bench, guild_id: int, users: int):
+        self.bench = bench
+        self.id = guild_id
+        self.name = 'bench-{}'.format(guild_id)
+        self.chunked = True
+        self.voice_client = None
+        self.channels = {}
+        self.roles = {}
+
+        self.me = FakeMember(self, bench.next_id(), 'racingbot', bot=True)
+        self.text = self._add(FakeTextChannel(self, bench.next_id(), 'music'))
+        self.category = self._add(FakeTextChannel(self, bench.next_id(), 'temp'))
+        self.lobby = self._add(FakeVoiceChannel(self, bench.next_id(), 'lobby'))
+        self.music = self._add(FakeVoiceChannel(self, bench.next_id(), 'music'))
+        self.members = [FakeMember(self, bench.next_id(), 'user{}'.format(n)) for n in range(users)]
+        for member in self.members:
+            member.move(self.music)
+
+        for n in range(5):
+            role = FakeRole(self, bench.next_id(), 'shop{}'.format(n))
+            self.roles[role.id] = role
+
+    def _add(self, channel):
+        self.channels[channel.id] = channel
+        return channel
+
+    def get_channel(self, channel_id: int):
+        return self.channels.get(channel_id)
+
+    def get_role(self, role_id: int):
+        return self.roles.get(role_id)
+
+    def get_member(self, user_id: int):
+        return next((member for member in self.members if member.id == user_id), None)
+
+    async def create_voice_channel(self, name: str, *, category=None, overwrites=None):
+        return self._add(FakeVoiceChannel(self, self.bench.next_id(), name, category=category))
+
+
+def percentile(values, q: float):
+    return values[min(len(values) - 1, int(round(q * (len(values) - 1))))]
+
+
+class Bench:
+    def __init__(self, bot_module, args):
+        self.bot_module = bot_module
+        self.bot = bot_module.bot
+        self.args = args
+        self.random = random.Random(args.seed)
+        self._ids = iter(range(10 ** 17, 10 ** 18))
+
+        self.mix = {}
+        for item in args.mix.split(','):
+            action, weight = item.split('=')
+            self.mix[action] = float(weight)
+
+        # command -> [(seconds, ok)]
+        self.samples = {}
+        self.blocked = 0.0
+        self.max_block = 0.0
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def context(self, member: FakeMember, content: str):
+        message = FakeMessage(member.guild.text, member, content)
+        return BenchContext(message=message, bot=self.bot, prefix='!')
+
+    async def invoke(self, member: FakeMember, name: str, *args, **kwargs):
+        """Runs a command the way Command.invoke does, minus parsing the message."""
+
+        command = self.bot.get_command(name)
+        ctx = self.context(member, '!' + name)
+        ctx.command = command
+        ctx.invoked_with = name
+        self.bot.dispatch('command', ctx)
+
+        started = time.perf_counter()
+        ok = True
+        try:
+            if not await command.can_run(ctx):
+                raise commands.CheckFailure('The check functions for command {} failed.'.format(name))
+            await command.call_before_hooks(ctx)
+            try:
+                await command(ctx, *args, **kwargs)
+            finally:
+                await command.call_after_hooks(ctx)
+        except commands.CommandError as error:
+            ok = False
+            await command.dispatch_error(ctx, error)
+        except Exception as error:
+            ok = False
+            await command.dispatch_error(ctx, commands.CommandInvokeError(error))
+        else:
+            self.bot.dispatch('command_completion', ctx)
+
+        self.samples.setdefault(name, []).append((time.perf_counter() - started, ok))
+
+    async def voice(self, member: FakeMember):
+        """Goes through the temporary channel lobby and comes back to the music channel."""
+
+        guild = member.guild
+        started = time.perf_counter()
+        await member.move_to(guild.lobby)
+        before = member.voice
+        member.move(guild.music)
+        await self.bot_module.on_voice_state_update(member, before, member.voice)
+        self.samples.setdefault('voice', []).append((time.perf_counter() - started, True))
+
+    async def user(self, guild: FakeGuild, member: FakeMember):
+        actions, weights = zip(*self.mix.items())
+        for _ in range(self.args.commands):
+            action = self.random.choices(actions, weights)[0]
+            if action == 'play':
+                await self.invoke(member, 'play', search='bench song {}'.format(self.random.randrange(self.args.tracks)))
+            elif action == 'queue':
+                await self.invoke(member, 'queue')
+            elif action == 'skip':
+                await self.invoke(member, 'skip')
+            elif action == 'give':
+                receiver = self.random.choice(guild.members)
+                await self.invoke(member, 'give', receiver, self.random.randint(1, 50))
+            elif action == 'buy':
+                await self.invoke(member, 'buy', self.random.choice(list(guild.roles.values())))
+            elif action == 'timely':
+                await self.invoke(member, 'timely')
+            elif action == 'voice':
+                await self.voice(member)
+            else:
+                raise SystemExit('Unknown action {!r}'.format(action))
+
+            if self.args.think:
+                await asyncio.sleep(self.random.expovariate(1 / self.args.think))
+
+    async def probe(self, interval: float = 0.005):
+        # Anything that keeps the loop from waking this up on time blocked it.
+        while True:
+            expected = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            lag = max(time.perf_counter() - expected, 0.0)
+            self.blocked += lag
+            self.max_block = max(self.max_block, lag)
+
+    async def setup(self):
+        guilds = [FakeGuild(self, self.next_id(), self.args.users) for _ in range(self.args.guilds)]
+        settings = self.bot_module.settings
+        economy = self.bot_module.economy
+        for guild in guilds:
+            settings.set(guild.id, 'temp_lobby', guild.lobby.id)
+            settings.set(guild.id, 'temp_category', guild.category.id)
+            for role in guild.roles.values():
+                await economy.add_shop_item(role.id, 100)
+            for member in guild.members:
+                await economy.credit(member.id, self.args.balance)
+        return guilds
+
+    async def run(self):
+        guilds = await self.setup()
+        rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        probe = asyncio.get_event_loop().create_task(self.probe())
+
+        started = time.perf_counter()
+        await asyncio.gather(*(self.user(guild, member) for guild in guilds for member in guild.members))
+        wall = time.perf_counter() - started
+        probe.cancel()
+
+        music = self.bot.get_cog('Music')
+        results = {
+            'config': {name: value for name, value in vars(self.args).items() if name not in ('output', 'baseline')},
+            'wall_seconds': round(wall, 3),
+            'commands': sum(len(samples) for samples in self.samples.values()),
+            'commands_per_second': round(sum(len(samples) for samples in self.samples.values()) / wall, 1),
+            'latency_ms': self.latencies(),
+            'loop': {
+                'blocked_seconds': round(self.blocked, 3),
+                'blocked_share': round(self.blocked / wall, 4),
+                'max_block_ms': round(self.max_block * 1000, 2),
+            },
+            'memory': {
+                'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                'rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before,
+            },
+            'music': {name: value for name, value in music.stats().items() if name != 'max_rss_kb'},
+            'extraction': self.bot_module.YTDLSource.engine.stats(),
+            'caches': self.bot_module.YTDLSource.cache_stats(),
+        }
+        if tracemalloc.is_tracing():
+            results['memory']['traced_peak_kb'] = tracemalloc.get_traced_memory()[1] // 1024
+
+        for guild_id in list(music.voice_states):
+            await music.drop_voice_state(guild_id)
+        return results
+
+    def latencies(self):
+        latencies = {}
+        everything = []
+        for name, samples in sorted(self.samples.items()):
+            everything += samples
+            latencies[name] = self.summary(samples)
+        latencies['all'] = self.summary(everything)
+        return latencies
+
+    @staticmethod
+    def summary(samples):
+        seconds = sorted(seconds for seconds, _ in samples)
+        return {
+            'count': len(samples),
+            'errors': sum(1 for _, ok in samples if not ok),
+            'p50': round(percentile(seconds, 0.5) * 1000, 2),
+            'p99': round(percentile(seconds, 0.99) * 1000, 2),
+            'max': round(seconds[-1] * 1000, 2),
+        }
+
+
+def compare(results: dict, baseline: dict):
+    """This run's numbers relative to the baseline's, as ratios."""
+
+    def ratio(new, old):
+        return round(new / old, 3) if old else None
+
+    change = {
+        'commands_per_second': ratio(results['commands_per_second'], baseline['commands_per_second']),
+        'blocked_seconds': ratio(results['loop']['blocked_seconds'], baseline['loop']['blocked_seconds']),
+        'max_rss_kb': ratio(results['memory']['max_rss_kb'], baseline['memory']['max_rss_kb']),
+    }
+    for name, latency in results['latency_ms'].items():
+        old = baseline['latency_ms'].get(name)
+        if old is not None:
+            change[name] = {'p50': ratio(latency['p50'], old['p50']), 'p99': ratio(latency['p99'], old['p99'])}
+    return change
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--users', type=int, default=10, help='members per guild, all running commands at once')
+    parser.add_argument('--commands', type=int, default=20, help='commands per member')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='relative weight of each action')
+    parser.add_argument('--think', type=float, default=0.0, help='mean pause between a member\'s commands')
+    parser.add_argument('--tracks', type=int, default=200, help='distinct songs members ask for')
+    parser.add_argument('--song-seconds', type=float, default=3, help='how long every song plays')
+    parser.add_argument('--latency', type=float, default=0.3, help='seconds every youtube-dl call takes')
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--pool', choices=('process', 'thread'), default='process', help='youtube-dl worker pool')
+    parser.add_argument('--engine', choices=('pcm', 'opus'), default='pcm', help='playback engine')
+    parser.add_argument('--balance', type=int, default=1000, help='coins every member starts with')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tracemalloc', action='store_true', help='also trace allocations (slows the run down)')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    parser.add_argument('--baseline', help='results of an earlier run to compare against')
+    args = parser.parse_args()
+
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+
+    os.environ.update(YTDL_POOL=args.pool, PLAYBACK_ENGINE=args.engine, METRICS_ADDRESS='', IMAGE_PROVIDER='stub',
+                      AUDIO_CACHE_MB='0')
+    os.environ.pop('IPC_ADDRESS', None)
+    os.environ.pop('CLUSTER_ID', None)
+
+    # Importing the bot sets up its stores in the working directory.
+    os.chdir(tempfile.mkdtemp(prefix='racingbot-bench-'))
+    random.seed(args.seed)
+    if args.tracemalloc:
+        tracemalloc.start()
+
+    import youtube_dl
+
+    # Patched before the bot starts any ffmpeg or youtube-dl worker.
+    StubYoutubeDL.latency = args.latency
+    StubYoutubeDL.jitter = args.jitter
+    youtube_dl.YoutubeDL = StubYoutubeDL
+    SilentAudio.frames = int(args.song_seconds * 50)
+    discord.FFmpegPCMAudio = SilentAudio
+    discord.FFmpegOpusAudio = SilentOpusAudio
+
+    import bot
+
+    loop = bot.bot.loop
+    results = loop.run_until_complete(Bench(bot, args).run())
+    loop.run_until_complete(bot.bot.close())
+    if baseline is not None:
+        results['change'] = compare(results, baseline)
+
+    print(json.dumps(results, indent=2))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
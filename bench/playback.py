@@ -0,0 +1,110 @@
+"""Compares the CPU cost per stream of the PCM and Opus playback engines.
+
+Every engine plays the same input through ``--streams`` sources at once,
+as fast as ffmpeg delivers it, doing the per-frame work the voice client
+would do: PCM frames are volume-scaled and Opus-encoded here, Opus
+packets are passed through untouched. Reported is the CPU time spent per
+second of audio and stream, in this process and in the ffmpeg children.
+
+    python bench/playback.py song.webm --streams 4 --seconds 30
+
+Needs ffmpeg on PATH, libopus and the resource module (so not Windows).
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def cpu_children():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def run_engine(bot, engine, track, *, streams, frames, volume):
+    import discord
+
+    bot.YTDLSource.PLAYBACK_ENGINE = engine
+    encoder = discord.opus.Encoder()
+    sources = [bot.YTDLSource.create_source(track, volume=volume) for _ in range(streams)]
+
+    started = time.perf_counter()
+    own_before = time.process_time()
+    children_before = cpu_children()
+
+    played = 0
+    for _ in range(frames):
+        for source in sources:
+            data = source.read()
+            if not data:
+                continue
+            if not source.is_opus():
+                encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+            played += 1
+
+    own = time.process_time() - own_before
+    # cleanup() kills and reaps ffmpeg, which is when its CPU time shows up.
+    for source in sources:
+        source.cleanup()
+    children = cpu_children() - children_before
+
+    audio_seconds = played * discord.opus.Encoder.FRAME_LENGTH / 1000
+    if not audio_seconds:
+        raise SystemExit('{} engine produced no audio, is the input playable?'.format(engine))
+
+    return {
+        'engine': engine,
+        'streams': streams,
+        'audio_seconds': audio_seconds,
+        'wall_seconds': time.perf_counter() - started,
+        'bot_cpu_ms_per_audio_second': own / audio_seconds * 1000,
+        'ffmpeg_cpu_ms_per_audio_second': children / audio_seconds * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('input', help='audio file or stream URL')
+    parser.add_argument('--streams', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=30, help='audio to play per stream')
+    parser.add_argument('--volume', type=float, default=0.5)
+    parser.add_argument('--codec', default=None, help="input codec, 'opus' lets the Opus engine copy at volume 1")
+    parser.add_argument('--engines', default='pcm,opus')
+    parser.add_argument('--output', help='also write the results to this JSON file')
+    args = parser.parse_args()
+
+    stream_url = args.input
+    if '://' not in stream_url:
+        stream_url = os.path.abspath(stream_url)
+    output = os.path.abspath(args.output) if args.output else None
+
+    # Importing the bot sets up its stores in the working directory.
+    os.chdir(tempfile.mkdtemp(prefix='racingbot-bench-'))
+    import bot
+
+    if '://' not in stream_url:
+        # The reconnect options only exist for network inputs.
+        bot.YTDLSource.FFMPEG_OPTIONS['before_options'] = ''
+
+    track = bot.Track('bench', stream_url, stream_url=stream_url, codec=args.codec)
+    frames = int(args.seconds * 50)
+    results = [run_engine(bot, engine, track, streams=args.streams, frames=frames, volume=args.volume)
+               for engine in args.engines.split(',')]
+
+    bot.bot.loop.run_until_complete(bot.bot.close())
+
+    print(json.dumps(results, indent=2))
+    if output:
+        with open(output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
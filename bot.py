@@ -1,735 +1,4163 @@
-import asyncio
-import functools
-import itertools
-import math
-import random
-
-import discord
-import json
-import youtube_dl
-from discord import utils
-from discord import Activity, ActivityType
-from async_timeout import timeout
-from discord.ext import commands
-from discord.ext.commands import Bot
-from discord import utils
-import nekos
-import datetime
-import time
-
-# Silence useless bug reports messages
-youtube_dl.utils.bug_reports_message = lambda: ''
-
-
-class VoiceError(Exception):
-    pass
-
-
-class YTDLError(Exception):
-    pass
-
-
-class YTDLSource(discord.PCMVolumeTransformer):
-    YTDL_OPTIONS = {
-        'format': 'bestaudio/best',
-        'extractaudio': True,
-        'audioformat': 'mp3',
-        'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
-        'restrictfilenames': True,
-        'noplaylist': True,
-        'nocheckcertificate': True,
-        'ignoreerrors': False,
-        'logtostderr': False,
-        'quiet': True,
-        'no_warnings': True,
-        'default_search': 'auto',
-        'source_address': '0.0.0.0',
-    }
-
-    FFMPEG_OPTIONS = {
-        'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
-        'options': '-vn',
-    }
-
-    ytdl = youtube_dl.YoutubeDL(YTDL_OPTIONS)
-
-    def __init__(self, ctx: commands.Context, source: discord.FFmpegPCMAudio, *, data: dict, volume: float = 0.5):
-        super().__init__(source, volume)
-
-        self.requester = ctx.author
-        self.channel = ctx.channel
-        self.data = data
-
-        self.uploader = data.get('uploader')
-        self.uploader_url = data.get('uploader_url')
-        date = data.get('upload_date')
-        self.upload_date = date[6:8] + '.' + date[4:6] + '.' + date[0:4]
-        self.title = data.get('title')
-        self.thumbnail = data.get('thumbnail')
-        self.description = data.get('description')
-        self.duration = self.parse_duration(int(data.get('duration')))
-        self.tags = data.get('tags')
-        self.url = data.get('webpage_url')
-        self.views = data.get('view_count')
-        self.likes = data.get('like_count')
-        self.dislikes = data.get('dislike_count')
-        self.stream_url = data.get('url')
-
-    def __str__(self):
-        return '**{0.title}** by **{0.uploader}**'.format(self)
-
-    @classmethod
-    async def create_source(cls, ctx: commands.Context, search: str, *, loop: asyncio.BaseEventLoop = None):
-        loop = loop or asyncio.get_event_loop()
-
-        partial = functools.partial(cls.ytdl.extract_info, search, download=False, process=False)
-        data = await loop.run_in_executor(None, partial)
-
-        if data is None:
-            raise YTDLError('Couldn\'t find anything that matches `{}`'.format(search))
-
-        if 'entries' not in data:
-            process_info = data
-        else:
-            process_info = None
-            for entry in data['entries']:
-                if entry:
-                    process_info = entry
-                    break
-
-            if process_info is None:
-                raise YTDLError('Couldn\'t find anything that matches `{}`'.format(search))
-
-        webpage_url = process_info['webpage_url']
-        partial = functools.partial(cls.ytdl.extract_info, webpage_url, download=False)
-        processed_info = await loop.run_in_executor(None, partial)
-
-        if processed_info is None:
-            raise YTDLError('Couldn\'t fetch `{}`'.format(webpage_url))
-
-        if 'entries' not in processed_info:
-            info = processed_info
-        else:
-            info = None
-            while info is None:
-                try:
-                    info = processed_info['entries'].pop(0)
-                except IndexError:
-                    raise YTDLError('Couldn\'t retrieve any matches for `{}`'.format(webpage_url))
-
-        return cls(ctx, discord.FFmpegPCMAudio(info['url'], **cls.FFMPEG_OPTIONS), data=info)
-
-    @staticmethod
-    def parse_duration(duration: int):
-        minutes, seconds = divmod(duration, 60)
-        hours, minutes = divmod(minutes, 60)
-        days, hours = divmod(hours, 24)
-
-        duration = []
-        if days > 0:
-            duration.append('{} дней'.format(days))
-        if hours > 0:
-            duration.append('{} часов'.format(hours))
-        if minutes > 0:
-            duration.append('{} минут'.format(minutes))
-        if seconds > 0:
-            duration.append('{} секунд'.format(seconds))
-
-        return ', '.join(duration)
-
-
-class Song:
-    __slots__ = ('source', 'requester')
-
-    def __init__(self, source: YTDLSource):
-        self.source = source
-        self.requester = source.requester
-
-    def create_embed(self):
-        embed = (discord.Embed(title='Опа,смотри что играет',
-                               description='```css\n{0.source.title}\n```'.format(self),
-                               color=discord.Color.blurple())
-                 .add_field(name='Время прослушивания', value=self.source.duration)
-                 .add_field(name='Запросил', value=self.requester.mention)
-                 .add_field(name='Автор видео', value='[{0.source.uploader}]({0.source.uploader_url})'.format(self))
-                 .add_field(name='Ссылка(кликни)', value='[Click]({0.source.url})'.format(self))
-                 .set_thumbnail(url=self.source.thumbnail))
-
-        return embed
-
-
-class SongQueue(asyncio.Queue):
-    def __getitem__(self, item):
-        if isinstance(item, slice):
-            return list(itertools.islice(self._queue, item.start, item.stop, item.step))
-        else:
-            return self._queue[item]
-
-    def __iter__(self):
-        return self._queue.__iter__()
-
-    def __len__(self):
-        return self.qsize()
-
-    def clear(self):
-        self._queue.clear()
-
-    def shuffle(self):
-        random.shuffle(self._queue)
-
-    def remove(self, index: int):
-        del self._queue[index]
-
-
-class VoiceState:
-    def __init__(self, bot: commands.Bot, ctx: commands.Context):
-        self.bot = bot
-        self._ctx = ctx
-
-        self.current = None
-        self.voice = None
-        self.next = asyncio.Event()
-        self.songs = SongQueue()
-
-        self._loop = False
-        self._volume = 0.5
-        self.skip_votes = set()
-
-        self.audio_player = bot.loop.create_task(self.audio_player_task())
-
-    def __del__(self):
-        self.audio_player.cancel()
-
-    @property
-    def loop(self):
-        return self._loop
-
-    @loop.setter
-    def loop(self, value: bool):
-        self._loop = value
-
-    @property
-    def volume(self):
-        return self._volume
-
-    @volume.setter
-    def volume(self, value: float):
-        self._volume = value
-
-    @property
-    def is_playing(self):
-        return self.voice and self.current
-
-    async def audio_player_task(self):
-        while True:
-            self.next.clear()
-
-            if not self.loop:
-                # Try to get the next song within 3 minutes.
-                # If no song will be added to the queue in time,
-                # the player will disconnect due to performance
-                # reasons.
-                try:
-                    async with timeout(180):  # 3 minutes
-                        self.current = await self.songs.get()
-                except asyncio.TimeoutError:
-                    self.bot.loop.create_task(self.stop())
-                    return
-
-            self.current.source.volume = self._volume
-            self.voice.play(self.current.source, after=self.play_next_song)
-            await self.current.source.channel.send(embed=self.current.create_embed())
-
-            await self.next.wait()
-
-    def play_next_song(self, error=None):
-        if error:
-            raise VoiceError(str(error))
-
-        self.next.set()
-
-    def skip(self):
-        self.skip_votes.clear()
-
-        if self.is_playing:
-            self.voice.stop()
-
-    async def stop(self):
-        self.songs.clear()
-
-        if self.voice:
-            await self.voice.disconnect()
-            self.voice = None
-
-
-class Music(commands.Cog):
-    def __init__(self, bot: commands.Bot):
-        self.bot = bot
-        self.voice_states = {}
-
-    def get_voice_state(self, ctx: commands.Context):
-        state = self.voice_states.get(ctx.guild.id)
-        if not state:
-            state = VoiceState(self.bot, ctx)
-            self.voice_states[ctx.guild.id] = state
-
-        return state
-
-    def cog_unload(self):
-        for state in self.voice_states.values():
-            self.bot.loop.create_task(state.stop())
-
-    def cog_check(self, ctx: commands.Context):
-        if not ctx.guild:
-            raise commands.NoPrivateMessage('Эта команда не используется в ЛС (Личные сообщения)')
-
-        return True
-
-    async def cog_before_invoke(self, ctx: commands.Context):
-        ctx.voice_state = self.get_voice_state(ctx)
-
-    async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
-        await ctx.send('Меня это пугает. Произошла какая-то ошибка: {}'.format(str(error)))
-
-    @commands.command(name='join', invoke_without_subcommand=True)
-    async def _join(self, ctx: commands.Context):
-        """Joins a voice channel."""
-
-        destination = ctx.author.voice.channel
-        if ctx.voice_state.voice:
-            await ctx.voice_state.voice.move_to(destination)
-            return
-
-        ctx.voice_state.voice = await destination.connect()
-
-    @commands.command(name='summon')
-    @commands.has_permissions(manage_guild=True)
-    async def _summon(self, ctx: commands.Context, *, channel: discord.VoiceChannel = None):
-        """Summons the bot to a voice channel.
-        If no channel was specified, it joins your channel.
-        """
-
-        if not channel and not ctx.author.voice:
-            raise VoiceError('Вы не подключены к голосовому каналу. И не указали куда подключаться.')
-
-        destination = channel or ctx.author.voice.channel
-        if ctx.voice_state.voice:
-            await ctx.voice_state.voice.move_to(destination)
-            return
-
-        ctx.voice_state.voice = await destination.connect()
-
-    @commands.command(name='leave', aliases=['disconnect'])
-    @commands.has_permissions(manage_guild=True)
-    async def _leave(self, ctx: commands.Context):
-        """Clears the queue and leaves the voice channel."""
-
-        if not ctx.voice_state.voice:
-            return await ctx.send('Бот и так не подключен. Зачем его кикать?')
-
-        await ctx.voice_state.stop()
-        del self.voice_states[ctx.guild.id]
-
-    @commands.command(name='volume')
-    async def _volume(self, ctx: commands.Context, *, volume: int):
-        """Sets the volume of the player."""
-
-        if not ctx.voice_state.is_playing:
-            return await ctx.send('Сейчас музыка не играет. Можете включить.')
-
-        if 0 > volume > 100:
-            return await ctx.send('Volume must be between 0 and 100')
-
-        ctx.voice_state.volume = volume / 100
-        await ctx.send('Громкость изменена на {}%'.format(volume))
-
-    @commands.command(name='now', aliases=['current', 'playing'])
-    async def _now(self, ctx: commands.Context):
-        """Displays the currently playing song."""
-
-        await ctx.send(embed=ctx.voice_state.current.create_embed())
-
-    @commands.command(name='pause')
-    @commands.has_permissions(manage_guild=True)
-    async def _pause(self, ctx: commands.Context):
-        """Pauses the currently playing song."""
-
-        if not ctx.voice_state.is_playing and ctx.voice_state.voice.is_playing():
-            ctx.voice_state.voice.pause()
-            await ctx.message.add_reaction('⏯')
-
-    @commands.command(name='resume')
-    @commands.has_permissions(manage_guild=True)
-    async def _resume(self, ctx: commands.Context):
-        """Resumes a currently paused song."""
-
-        if not ctx.voice_state.is_playing and ctx.voice_state.voice.is_paused():
-            ctx.voice_state.voice.resume()
-            await ctx.message.add_reaction('⏯')
-
-    @commands.command(name='stop')
-    @commands.has_permissions(manage_guild=True)
-    async def _stop(self, ctx: commands.Context):
-        """Stops playing song and clears the queue."""
-
-        ctx.voice_state.songs.clear()
-
-        if not ctx.voice_state.is_playing:
-            ctx.voice_state.voice.stop()
-            await ctx.message.add_reaction('⏹')
-
-    @commands.command(name='skip')
-    async def _skip(self, ctx: commands.Context):
-        """Vote to skip a song. The requester can automatically skip.
-        3 skip votes are needed for the song to be skipped.
-        """
-
-        if not ctx.voice_state.is_playing:
-            return await ctx.send('Сейчас музыка не играет,зачем её пропускать? Можете включить.')
-
-        voter = ctx.message.author
-        if voter == ctx.voice_state.current.requester:
-            await ctx.message.add_reaction('⏭')
-            ctx.voice_state.skip()
-
-        elif voter.id not in ctx.voice_state.skip_votes:
-            ctx.voice_state.skip_votes.add(voter.id)
-            total_votes = len(ctx.voice_state.skip_votes)
-
-            if total_votes >= 3:
-                await ctx.message.add_reaction('⏭')
-                ctx.voice_state.skip()
-            else:
-                await ctx.send('Голосование за пропуск добавлено. Проголосовали: **{}/3**'.format(total_votes))
-
-        else:
-            await ctx.send('Вы уже голосовали за пропуск этого трека.')
-
-    @commands.command(name='queue')
-    async def _queue(self, ctx: commands.Context, *, page: int = 1):
-        """Shows the player's queue.
-        You can optionally specify the page to show. Each page contains 10 elements.
-        """
-
-        if len(ctx.voice_state.songs) == 0:
-            return await ctx.send('В очереди нет треков. Можете добавить.')
-
-        items_per_page = 10
-        pages = math.ceil(len(ctx.voice_state.songs) / items_per_page)
-
-        start = (page - 1) * items_per_page
-        end = start + items_per_page
-
-        queue = ''
-        for i, song in enumerate(ctx.voice_state.songs[start:end], start=start):
-            queue += '`{0}.` [**{1.source.title}**]({1.source.url})\n'.format(i + 1, song)
-
-        embed = (discord.Embed(description='**{} tracks:**\n\n{}'.format(len(ctx.voice_state.songs), queue))
-                 .set_footer(text='Viewing page {}/{}'.format(page, pages)))
-        await ctx.send(embed=embed)
-
-    @commands.command(name='shuffle')
-    async def _shuffle(self, ctx: commands.Context):
-        """Shuffles the queue."""
-
-        if len(ctx.voice_state.songs) == 0:
-            return await ctx.send('В очереди нет треков. Можете добавить.')
-
-        ctx.voice_state.songs.shuffle()
-        await ctx.message.add_reaction('✅')
-
-    @commands.command(name='remove')
-    async def _remove(self, ctx: commands.Context, index: int):
-        """Removes a song from the queue at a given index."""
-
-        if len(ctx.voice_state.songs) == 0:
-            return await ctx.send('В очереди нет треков. Можете добавить.')
-
-        ctx.voice_state.songs.remove(index - 1)
-        await ctx.message.add_reaction('✅')
-
-    @commands.command(name='loop')
-    async def _loop(self, ctx: commands.Context):
-        """Loops the currently playing song.
-        Invoke this command again to unloop the song.
-        """
-
-        if not ctx.voice_state.is_playing:
-            return await ctx.send('Ничего не играет в данный момент.')
-
-        # Inverse boolean value to loop and unloop.
-        ctx.voice_state.loop = not ctx.voice_state.loop
-        await ctx.message.add_reaction('✅')
-
-    @commands.command(name='play')
-    async def _play(self, ctx: commands.Context, *, search: str):
-        """Plays a song.
-        If there are songs in the queue, this will be queued until the
-        other songs finished playing.
-        This command automatically searches from various sites if no URL is provided.
-        A list of these sites can be found here: https://rg3.github.io/youtube-dl/supportedsites.html
-        """
-
-        if not ctx.voice_state.voice:
-            await ctx.invoke(self._join)
-
-        async with ctx.typing():
-            try:
-                source = await YTDLSource.create_source(ctx, search, loop=self.bot.loop)
-            except YTDLError as e:
-                await ctx.send('Произошла ошибка при обработке этого запроса: {}'.format(str(e)))
-            else:
-                song = Song(source)
-
-                await ctx.voice_state.songs.put(song)
-                await ctx.send('Успешно добавлено {}'.format(str(source)))
-
-    @_join.before_invoke
-    @_play.before_invoke
-    async def ensure_voice_state(self, ctx: commands.Context):
-        if not ctx.author.voice or not ctx.author.voice.channel:
-            raise commands.CommandError('Сначала подключись к голосовому.')
-
-        if ctx.voice_client:
-            if ctx.voice_client.channel != ctx.author.voice.channel:
-                raise commands.CommandError('Бот уже подключен с голосовому каналу.')
-
-
-bot = commands.Bot('!', intents = discord.Intents().all())
-bot.remove_command('help')
-bot.add_cog(Music(bot))
-
-@bot.command()
-async def say(ctx, *, msg: str = None):
-  await ctx.send(embed = discord.Embed(description = msg))
-    
-#Clear Chat
-@bot.command( pass_context = True )
-
-async def clear( ctx, amount = 100 ):
-    await ctx.channel.purge( limit = amount )
-
-@bot.event
-async def on_member_join( member ):
-    channel = bot.get_channel( 850100716559400960 )
-
-    role = discord.utils.get( member.guild.roles, id = 850027060864352266 )
-
-    await member.add_roles( role )
-    await channel.send( embed = discord.Embed(description = f'Пользователь ``{ member.name }``, присоединился к нам!',
-     color = 0x0c0c0c ) )
-
-@bot.command( pass_context = True )
-
-async def help( ctx ):
-    emb = discord.Embed( title = 'Навигация по командам' )
-
-    emb.add_field( name = '{}play'.format( '!' ), value = 'Включить музыку' )
-    emb.add_field( name = '{}stop'.format( '!' ), value = 'Выключить музыку' )
-    emb.add_field( name = '{}skip'.format( '!' ), value = 'Пропустить музыку' )
-    emb.add_field( name = '{}cum'.format( '!' ), value = 'Что-то интересное в 18+ канале' )
-    emb.add_field( name = '{}info'.format( '!' ), value = 'Узнать информацию о пользователе' )
-
-    await ctx.send( embed = emb )
-
-@bot.event
-async def on_voice_state_update(member,before,after):
-    if after.channel.id == 850728985854738440:
-        for guild in bot.guilds:
-            maincategory = discord.utils.get(guild.categories, id=850021698472247346)
-            channel2 = await guild.create_voice_channel(name=f'канал {member.display_name}',category = maincategory)
-            await channel2.set_permissions(member,connect=True,mute_members=True,move_members=True,manage_channels=True)
-            await member.move_to(channel2)
-            def check(x,y,z):
-                return len(channel2.members) == 0
-            await bot.wait_for('voice_state_update',check=check)
-            await channel2.delete()
-
-@bot.command()
-async def timely(ctx):
-    with open('economy.json','r') as f:
-        money = json.load(f)
-    if not str(ctx.author.id) in money:
-        money[str(ctx.author.id)] = {}
-        money[str(ctx.author.id)]['Money'] = 0
-
-    if not str(ctx.author.id) in queue:
-        emb = discord.Embed(description=f'**{ctx.author}** Вы получили свои 1250 монет')
-        await ctx.send(embed= emb)
-        money[str(ctx.author.id)]['Money'] += 1250
-        queue.append(str(ctx.author.id))
-        with open('economy.json','w') as f:
-            json.dump(money,f)
-        await asyncio.sleep(12*60)
-        queue.remove(str(ctx.author.id))
-    if str(ctx.author.id) in queue:
-        emb = discord.Embed(description=f'**{ctx.author}** Вы уже получили свою награду')
-        await ctx.send(embed= emb)
-@bot.command()
-async def balance(ctx,member:discord.Member = None):
-    if member == ctx.author or member == None:
-        with open('economy.json','r') as f:
-            money = json.load(f)
-        emb = discord.Embed(description=f'У **{ctx.author}** {money[str(ctx.author.id)]["Money"]} монет')
-        await ctx.send(embed= emb)
-    else:
-        with open('economy.json','r') as f:
-            money = json.load(f)
-        emb = discord.Embed(description=f'У **{member}** {money[str(member.id)]["Money"]} монет')
-        await ctx.send(embed= emb)
-@bot.command()
-async def addshop(ctx,role:discord.Role,cost:int):
-    with open('economy.json','r') as f:
-        money = json.load(f)
-    if str(role.id) in money['shop']:
-        await ctx.send("Эта роль уже есть в магазине")
-    if not str(role.id) in money['shop']:
-        money['shop'][str(role.id)] ={}
-        money['shop'][str(role.id)]['Cost'] = cost
-        await ctx.send('Роль добавлена в магазин')
-    with open('economy.json','w') as f:
-        json.dump(money,f)
-@bot.command()
-async def shop(ctx):
-    with open('economy.json','r') as f:
-        money = json.load(f)
-    emb = discord.Embed(title="Магазин")
-    for role in money['shop']:
-        emb.add_field(name=f'Цена: {money["shop"][role]["Cost"]}',value=f'<@&{role}>',inline=False)
-    await ctx.send(embed=emb)
-@bot.command()
-async def removeshop(ctx,role:discord.Role):
-    with open('economy.json','r') as f:
-        money = json.load(f)
-    if not str(role.id) in money['shop']:
-        await ctx.send("Этой роли нет в магазине")
-    if str(role.id) in money['shop']:
-        await ctx.send('Роль удалена из магазина')
-        del money['shop'][str(role.id)]
-    with open('economy.json','w') as f:
-        json.dump(money,f)
-@bot.command()
-async def buy(ctx,role:discord.Role):
-    with open('economy.json','r') as f:
-        money = json.load(f)
-    if str(role.id) in money['shop']:
-        if money['shop'][str(role.id)]['Cost'] <= money[str(ctx.author.id)]['Money']:
-            if not role in ctx.author.roles:
-                await ctx.send('Вы купили роль!')
-                for i in money['shop']:
-                    if i == str(role.id):
-                        buy = discord.utils.get(ctx.guild.roles,id = int(i))
-                        await ctx.author.add_roles(buy)
-                        money[str(ctx.author.id)]['Money'] -= money['shop'][str(role.id)]['Cost']
-            else:
-                await ctx.send('У вас уже есть эта роль!')
-    with open('economy.json','w') as f:
-        json.dump(money,f)
-
-@bot.command()
-async def give(ctx,member:discord.Member,arg:int):
-    with open('economy.json','r') as f:
-        money = json.load(f)
-    if money[str(ctx.author.id)]['Money'] >= arg:
-        emb = discord.Embed(description=f'**{ctx.author}** подарил **{member}** **{arg}** монет')
-        money[str(ctx.author.id)]['Money'] -= arg
-        money[str(member.id)]['Money'] += arg
-        await ctx.send(embed = emb)
-    else:
-        await ctx.send('У вас недостаточно денег')
-    with open('economy.json','w') as f:
-        json.dump(money,f)
-
-@bot.event
-async def on_raw_reaction_add(payload):
-    guild = await bot.fetch_guild(787791032745590845)
-    if payload.message_id == 850785149519527976 and payload.emoji.name == "💜":
-        role = discord.utils.get(guild.roles, id = 793859329672347679)
-        await payload.member.add_roles(role)
-
-@bot.command()
-@commands.has_permissions(view_audit_log=True)
-async def mute(ctx,member:discord.Member,time:int,reason):
-    role = discord.utils.get(ctx.guild.roles,id=850033230341341244)
-    channel = Bot.get_channel(850100716559400960)
-    await member.add_roles(role)
-    emb = discord.Embed(title="Мут",color=0x2f3136)
-    emb.add_field(name='Модератор',value=ctx.message.author.mention,inline=False)
-    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
-    emb.add_field(name='Причина',value=reason,inline=False)
-    emb.add_field(name="Время",value=time,inline=False)
-    await channel.send(embed = emb)
-    await asyncio.sleep(time*60 )
-    emb = discord.Embed(title="Анмут",color=0x2f3136)
-    emb.add_field(name='Модератор',value='<@709725675711496233>',inline=False)
-    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
-    emb.add_field(name='Причина',value="Время мута вышло",inline=False)
-    await channel.send(embed=emb)
-    await member.remove_roles(role)
-
-@bot.command()
-@commands.has_permissions(view_audit_log=True)
-async def unmute(ctx,member:discord.Member):
-    channel = Bot.get_channel(850100716559400960)
-    muterole = discord.utils.get(ctx.guild.roles,id=850033230341341244)
-    emb = discord.Embed(title="Анмут",color=0xff0000)
-    emb.add_field(name='Модератор',value=ctx.message.author.mention,inline=False)
-    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
-    await channel.send(embed = emb)
-    await member.remove_roles(muterole)
-
-@bot.command()
-@commands.has_permissions(view_audit_log=True)
-async def kick(ctx,member:discord.Member,reason):
-    channel = Bot.get_channel(850100716559400960)
-    emb = discord.Embed(title="Кик",color=0xff0000)
-    emb.add_field(name='Модератор',value=ctx.message.author.mention,inline=False)
-    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
-    emb.add_field(name='Причина',value=reason,inline=False)
-    await member.kick()
-    await channel.send(embed = emb)
-
-@bot.command()
-@commands.has_permissions(view_audit_log=True)
-async def ban(ctx,member:discord.Member,reason):
-    channel = Bot.get_channel(850100716559400960)
-    emb = discord.Embed(title="Кик",color=0xff0000)
-    emb.add_field(name='Модератор',value=ctx.message.author.mention,inline=False)
-    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
-    emb.add_field(name='Причина',value=reason,inline=False)
-    await member.ban()
-    await channel.send(embed = emb)
-
-@bot.command()
-async def info(ctx,member:discord.Member):
-    emb = discord.Embed(title='Информация о пользователе',color=0xff0000)
-    emb.add_field(name="Когда присоединился:",value=member.joined_at,inline=False)
-    emb.add_field(name='Имя:',value=member.display_name,inline=False)
-    emb.add_field(name='Айди:',value=member.id,inline=False)
-    emb.add_field(name="Аккаунт был создан:",value=member.created_at.strftime("%a,%#d %B %Y, %I:%M %p UTC"),inline=False)
-    emb.set_thumbnail(url=member.avatar_url)
-    emb.set_footer(text=f"Вызвано:{ctx.message.author}",icon_url=ctx.message.author.avatar_url)
-    emb.set_author(name=ctx.message.author,icon_url=ctx.message.author.avatar_url)
-    await ctx.send(embed = emb)
-
-Arguments = ['feet', 'yuri', 'trap', 'futanari', 'hololewd', 'lewdkemo', 'solog', 'feetg', 'cum', 'erokemo', 'les', 'wallpaper', 'lewdk', 'ngif', 'tickle', 'lewd', 'feed', 'gecg', 'eroyuri', 'eron', 'cum_jpg', 'bj', 'nsfw_neko_gif', 'solo', 'kemonomimi', 'nsfw_avatar', 'gasm', 'poke', 'anal', 'slap', 'hentai', 'avatar', 'erofeet', 'holo', 'keta', 'blowjob', 'pussy', 'tits', 'holoero', 'lizard', 'pussy_jpg', 'pwankg', 'classic', 'kuni', 'waifu', 'pat', '8ball', 'kiss', 'femdom', 'neko', 'spank', 'cuddle', 'erok', 'fox_girl', 'boobs', 'random_hentai_gif', 'smallboobs', 'hug', 'ero', 'smug', 'goose', 'baka', 'woof']
-def is_nsfw():
-    async def predicate(ctx):
-        return ctx.channel.is_nsfw()
-    return commands.check(predicate)
-
-@bot.command()
-@is_nsfw()
-async def cum(ctx):
-    emb = discord.Embed(color=0xebebeb)
-    emb.set_image(url=nekos.img('cum'))
-    await ctx.send(embed=emb)
-
-@bot.event
-async def on_ready():
-    print('Logged in as:\n{0.user.name}\n{0.user.id}'.format(bot))
-
-    await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="в твоё сердце"))
-
-bot.run("ODUwNzIwOTI1NTYwODY0Nzg4.YLt1mg.vUb3gTNkZZR846yCZpSrmWs9dU8")
-
+import asyncio
+import bisect
+import collections
+import concurrent.futures
+import functools
+import hashlib
+import heapq
+import io
+import itertools
+import logging
+import math
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import threading
+import traceback
+import weakref
+
+import aiohttp
+import discord
+import json
+import youtube_dl
+from discord import Activity, ActivityType
+from discord.ext import commands
+from aiohttp import web
+import datetime
+import time
+import urllib.parse
+
+import cluster
+
+# Silence useless bug reports messages
+youtube_dl.utils.bug_reports_message = lambda: ''
+
+log = logging.getLogger('racingbot')
+
+
+class VoiceError(Exception):
+    pass
+
+
+class YTDLError(Exception):
+    pass
+
+
+class TTLCache:
+    """Small LRU cache whose entries also expire after ``ttl`` seconds."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+        self._entries = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def pop(self, key):
+        entry = self._entries.pop(key, None)
+        return entry[1] if entry else None
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries), 'hits': self.hits, 'misses': self.misses}
+
+
+class Histogram:
+    """Counts observations into buckets, the way Prometheus histograms do."""
+
+    BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        index = bisect.bisect_left(self.buckets, value)
+        if index < len(self.buckets):
+            self.counts[index] += 1
+
+    def cumulative(self):
+        return list(zip(self.buckets, itertools.accumulate(self.counts)))
+
+
+def write_json_atomic(path: str, data):
+    """Writes ``data`` to ``path`` so that readers never see a half-written file."""
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class JsonStore:
+    """State kept in memory and written back to ``path`` as JSON.
+
+    Subclasses return what to save from ``_data`` and call ``_changed``
+    after each change. A background task rewrites the file off the event
+    loop, right after a change or, with ``flush_interval`` set, at most
+    once per interval. ``close`` writes whatever is still unsaved.
+    """
+
+    flush_interval = None
+
+    def __init__(self, path: str):
+        self.path = path
+
+        self._wakeup = asyncio.Event()
+        self._dirty = False
+        self._task = None
+
+    def _read(self):
+        with open(self.path, 'r') as f:
+            return json.load(f)
+
+    def load(self, default=None):
+        """Returns the saved data, or ``default`` if there is no file yet."""
+
+        try:
+            return self._read()
+        except FileNotFoundError:
+            # Written on the next flush, so the file exists from then on.
+            self._dirty = True
+            return default
+
+    def _data(self):
+        raise NotImplementedError
+
+    def _changed(self):
+        self._dirty = True
+        self._wakeup.set()
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if self._task is None:
+            self._task = loop.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        if self._dirty:
+            self._dirty = False
+            write_json_atomic(self.path, self._data())
+
+    async def _flush(self):
+        if not self._dirty:
+            return
+
+        self._dirty = False
+        try:
+            await asyncio.get_event_loop().run_in_executor(None, write_json_atomic, self.path, self._data())
+        except Exception:
+            self._dirty = True
+            log.exception('Failed to write %s', self.path)
+
+    async def _run(self):
+        while True:
+            await self._flush()
+            if self.flush_interval is None:
+                await self._wakeup.wait()
+                self._wakeup.clear()
+            else:
+                await asyncio.sleep(self.flush_interval)
+
+
+_worker_state = threading.local()
+
+
+def _worker_ytdl(options: dict):
+    # Each extraction worker keeps its own YoutubeDL per option set
+    # instead of sharing one across threads.
+    instances = getattr(_worker_state, 'ytdl', None)
+    if instances is None:
+        instances = _worker_state.ytdl = {}
+
+    key = json.dumps(options, sort_keys=True)
+    ytdl = instances.get(key)
+    if ytdl is None:
+        ytdl = instances[key] = youtube_dl.YoutubeDL(options)
+    return ytdl
+
+
+def _extract_in_worker(options: dict, url: str, process: bool, params: dict = None):
+    ytdl = _worker_ytdl(options)
+
+    # Per-job overrides such as the playlist range. A worker only runs
+    # one job at a time, so they are simply put back afterwards.
+    params = params or {}
+    saved = {name: ytdl.params.get(name) for name in params}
+    ytdl.params.update(params)
+    try:
+        info = ytdl.extract_info(url, download=False, process=process)
+    finally:
+        ytdl.params.update(saved)
+
+    if info is not None and 'entries' in info and not isinstance(info['entries'], list):
+        # Unprocessed results hand out entries lazily, which can't cross
+        # the process boundary.
+        info['entries'] = list(info['entries'])
+
+    return info
+
+
+def _download_in_worker(options: dict, url: str, directory: str):
+    """Downloads ``url`` as an Opus file into ``directory``.
+
+    Returns the file name, its size and its SHA-256. The file only gets
+    its final name once it is completely written and hashed.
+    """
+
+    ytdl = _worker_ytdl(options)
+    info = ytdl.extract_info(url, download=True)
+    if 'entries' in info:
+        info = info['entries'][0]
+
+    partial = os.path.splitext(ytdl.prepare_filename(info))[0] + '.opus'
+    digest = hashlib.sha256()
+    with open(partial, 'rb') as f:
+        for chunk in iter(functools.partial(f.read, 1 << 16), b''):
+            digest.update(chunk)
+        os.fsync(f.fileno())
+
+    name = digest.hexdigest()[:32] + '.opus'
+    os.replace(partial, os.path.join(directory, name))
+    return name, os.path.getsize(os.path.join(directory, name)), digest.hexdigest()
+
+
+class ExtractionEngine:
+    """Runs youtube-dl extractions on a dedicated worker pool.
+
+    Jobs wait in one queue per guild and are started round-robin across
+    guilds, with at most ``per_guild`` running for any single guild, so a
+    burst of !play in one server doesn't starve the others. ``mode`` is
+    'process' for a process pool (extraction is mostly GIL-bound Python)
+    or 'thread' where forking isn't available. A job's ``timeout`` only
+    starts once a worker picks it up, so waiting in a long queue doesn't
+    count against it.
+
+    The process pool forks all its workers in ``start``, while the bot
+    is still starting up. Forking later, once the loop, the executor and
+    the voice clients have threads of their own, can copy a lock one of
+    them holds into a worker where nobody ever releases it.
+    """
+
+    def __init__(self, options: dict, *, mode: str = 'process', workers: int = None, per_guild: int = 2,
+                 max_pending: int = 64, timeout: float = 30):
+        self.options = options
+        self.mode = mode
+        self.workers = workers or os.cpu_count() or 2
+        self.per_guild = per_guild
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self._executor = None
+        self._queues = collections.OrderedDict()
+        self._running = collections.Counter()
+        self._served = {}
+        self._turns = itertools.count()
+        self._active = 0
+        self._pending = 0
+        # Seconds per job from start to result, by job kind ('extract' or 'download').
+        self.job_seconds = collections.defaultdict(Histogram)
+
+    def _make_executor(self):
+        if self.mode == 'process':
+            try:
+                context = multiprocessing.get_context('fork')
+            except ValueError:
+                log.warning('Process extraction pool needs fork, falling back to threads')
+            else:
+                return concurrent.futures.ProcessPoolExecutor(self.workers, mp_context=context)
+
+        return concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='ytdl')
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            self._executor = self._make_executor()
+        return self._executor
+
+    def _replace_broken_executor(self):
+        if self.mode == 'process':
+            # Too late to fork safely, keep going on threads.
+            log.warning('Extraction worker died, continuing with a thread pool')
+            self.mode = 'thread'
+        self._executor = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if self.mode == 'process' and self._executor is None:
+            # The first job makes a fork pool start every worker at once.
+            self.executor.submit(int)
+
+    async def close(self):
+        self.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def stats(self):
+        return {'active': self._active, 'pending': self._pending, 'guilds_waiting': len(self._queues)}
+
+    async def extract(self, guild_id, url: str, *, process: bool = True, options: dict = None, params: dict = None):
+        args = (options or self.options, url, process, params)
+        return await self._submit(guild_id, _extract_in_worker, args, url=url, timeout=self.timeout)
+
+    async def download(self, guild_id, url: str, directory: str, *, options: dict, timeout: float = 600):
+        return await self._submit(guild_id, _download_in_worker, (options, url, directory), url=url, timeout=timeout)
+
+    async def _submit(self, guild_id, func, args, *, url: str, timeout: float):
+        if self._pending >= self.max_pending:
+            raise YTDLError('Слишком много запросов, попробуйте чуть позже')
+
+        future = asyncio.get_event_loop().create_future()
+        self._queues.setdefault(guild_id, collections.deque()).append((func, args, future, url, timeout))
+        self._pending += 1
+        self._pump()
+
+        return await future
+
+    def cancel(self, guild_id=None):
+        """Drops queued jobs, for one guild or all of them.
+
+        Jobs that already reached a worker finish there, but nobody waits
+        for their result anymore. Whoever waits for a dropped job gets a
+        YTDLError rather than a cancellation, which would otherwise end
+        the player task that happened to be waiting for it.
+        """
+
+        guild_ids = list(self._queues) if guild_id is None else [guild_id]
+        for guild_id in guild_ids:
+            for _, _, future, _, _ in self._queues.pop(guild_id, ()):
+                if not future.done():
+                    future.set_exception(YTDLError('Запрос отменён'))
+                self._pending -= 1
+
+    def _next_job(self, guild_id):
+        jobs = self._queues[guild_id]
+        job = None
+        while jobs and job is None:
+            job = jobs.popleft()
+            self._pending -= 1
+            if job[2].done():
+                # Its command was cancelled or timed out while waiting.
+                job = None
+
+        if not jobs:
+            del self._queues[guild_id]
+        return job
+
+    def _pump(self):
+        while self._active < self.workers:
+            ready = [guild_id for guild_id in self._queues if self._running[guild_id] < self.per_guild]
+            if not ready:
+                break
+
+            # Whoever was served longest ago goes next.
+            guild_id = min(ready, key=lambda guild_id: self._served.get(guild_id, -1))
+            job = self._next_job(guild_id)
+            if job is not None:
+                self._served[guild_id] = next(self._turns)
+                self._start(guild_id, job)
+
+    def _start(self, guild_id, job):
+        func, args, future, url, timeout = job
+        self._active += 1
+        self._running[guild_id] += 1
+
+        try:
+            work = asyncio.wrap_future(self.executor.submit(func, *args))
+        except concurrent.futures.BrokenExecutor:
+            self._replace_broken_executor()
+            work = asyncio.wrap_future(self.executor.submit(func, *args))
+
+        expiry = asyncio.get_event_loop().call_later(timeout, self._expire, future, url)
+        kind = func.__name__.strip('_').split('_')[0]
+        work.add_done_callback(functools.partial(self._finished, guild_id, future, expiry, kind, time.monotonic()))
+
+    @staticmethod
+    def _expire(future, url: str):
+        # The worker stays busy until the job ends, only the waiter gives up.
+        if not future.done():
+            future.set_exception(YTDLError('Timed out while fetching `{}`'.format(url)))
+
+    def _finished(self, guild_id, future, expiry, kind, started, work):
+        expiry.cancel()
+        self.job_seconds[kind].observe(time.monotonic() - started)
+        self._active -= 1
+        self._running[guild_id] -= 1
+        if not self._running[guild_id]:
+            del self._running[guild_id]
+            if guild_id not in self._queues:
+                self._served.pop(guild_id, None)
+
+        if not future.done():
+            if work.cancelled():
+                future.set_exception(YTDLError('Запрос отменён'))
+            elif work.exception() is not None:
+                error = work.exception()
+                if isinstance(error, concurrent.futures.BrokenExecutor):
+                    # A worker died; the next job gets a fresh pool.
+                    self._replace_broken_executor()
+                future.set_exception(YTDLError(str(error)) if not isinstance(error, YTDLError) else error)
+            else:
+                future.set_result(work.result())
+
+        self._pump()
+
+
+class BufferedAudio(discord.AudioSource):
+    """Wraps an audio source so its first frames can be read ahead of playback."""
+
+    def __init__(self, original: discord.AudioSource, *, start: float = 0.0):
+        self.original = original
+        self.start = start
+        self.frames_played = 0
+        self._frames = collections.deque()
+
+    def fill(self, count: int):
+        # Blocks on ffmpeg's pipe, run it in an executor.
+        for _ in range(count):
+            frame = self.original.read()
+            if not frame:
+                break
+            self._frames.append(frame)
+
+    def read(self):
+        frame = self._frames.popleft() if self._frames else self.original.read()
+        if frame:
+            self.frames_played += 1
+        return frame
+
+    @property
+    def elapsed(self):
+        """Seconds into the track, counting from where ffmpeg was started."""
+
+        return self.start + self.frames_played * discord.opus.Encoder.FRAME_LENGTH / 1000
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        self._frames.clear()
+        self.original.cleanup()
+
+
+class OpusSource(BufferedAudio):
+    """Hands the voice client ready-made Opus packets straight from ffmpeg.
+
+    With the default PCM engine every 20 ms frame is decoded to PCM,
+    scaled by PCMVolumeTransformer and Opus-encoded again in the bot
+    process. Here ffmpeg applies the volume with a filter and does the
+    encoding itself, or just copies the stream when it already is Opus
+    at full volume. A volume change restarts ffmpeg where playback is.
+    """
+
+    def __init__(self, track: 'Track', *, volume: float = 0.5, start: float = 0.0):
+        self.track = track
+        self.volume = volume
+
+        ffmpeg_options = YTDLSource.ffmpeg_options(track, start=start)
+        options = ffmpeg_options['options']
+        if volume == 1.0:
+            codec = track.codec
+        else:
+            codec = None
+            options += ' -filter:a volume={:.2f}'.format(volume)
+
+        super().__init__(discord.FFmpegOpusAudio(track.stream_url, codec=codec,
+                                                 before_options=ffmpeg_options['before_options'], options=options),
+                         start=start)
+
+    def __str__(self):
+        return str(self.track)
+
+    def with_volume(self, volume: float):
+        if volume == self.volume:
+            return self
+        return type(self)(self.track, volume=volume, start=self.elapsed)
+
+
+class Track:
+    """The handful of fields the bot renders or plays out of a youtube-dl info dict.
+
+    Info dicts carry every format, the description, tags and thumbnails,
+    often tens of KB per track, so they are dropped as soon as a track
+    is resolved. Playlist entries start out with just a title and URL.
+    """
+
+    __slots__ = ('title', 'url', 'uploader', 'uploader_url', 'duration', 'thumbnail',
+                 'stream_url', 'stream_expires_at', 'codec')
+
+    def __init__(self, title: str, url: str, *, uploader: str = None, uploader_url: str = None,
+                 duration: int = 0, thumbnail: str = None, stream_url: str = None, stream_expires_at: float = 0.0,
+                 codec: str = None):
+        self.title = title
+        self.url = url
+        self.uploader = uploader
+        self.uploader_url = uploader_url
+        self.duration = duration
+        self.thumbnail = thumbnail
+        self.stream_url = stream_url
+        self.stream_expires_at = stream_expires_at
+        self.codec = codec
+
+    @classmethod
+    def from_info(cls, info: dict, *, stream_expires_at: float):
+        return cls(info.get('title'), info.get('webpage_url'),
+                   uploader=info.get('uploader'),
+                   uploader_url=info.get('uploader_url'),
+                   duration=int(info.get('duration') or 0),
+                   thumbnail=info.get('thumbnail'),
+                   stream_url=info['url'],
+                   stream_expires_at=stream_expires_at,
+                   codec=info.get('acodec'))
+
+    def __str__(self):
+        if self.uploader is None:
+            return '**{0.title}**'.format(self)
+        return '**{0.title}** by **{0.uploader}**'.format(self)
+
+
+class YTDLSource(discord.PCMVolumeTransformer):
+    YTDL_OPTIONS = {
+        'format': 'bestaudio/best',
+        'extractaudio': True,
+        'audioformat': 'mp3',
+        'outtmpl': '%(extractor)s-%(id)s-%(title)s.%(ext)s',
+        'restrictfilenames': True,
+        'noplaylist': True,
+        'nocheckcertificate': True,
+        'ignoreerrors': False,
+        'logtostderr': False,
+        'quiet': True,
+        'no_warnings': True,
+        'default_search': 'auto',
+        'source_address': '0.0.0.0',
+    }
+
+    # Playlists are only listed up front; every entry is resolved on its
+    # own once it gets close to playing.
+    PLAYLIST_OPTIONS = dict(YTDL_OPTIONS, noplaylist=False, extract_flat='in_playlist')
+    PLAYLIST_PAGE = 100
+    PLAYLIST_LIMIT = int(os.environ.get('PLAYLIST_LIMIT', 1000))
+
+    FFMPEG_OPTIONS = {
+        'before_options': '-reconnect 1 -reconnect_streamed 1 -reconnect_delay_max 5',
+        'options': '-vn',
+    }
+
+    # 'pcm' decodes and scales volume in Python, 'opus' leaves both to ffmpeg.
+    PLAYBACK_ENGINE = os.environ.get('PLAYBACK_ENGINE', 'pcm')
+
+    engine = ExtractionEngine(YTDL_OPTIONS,
+                              mode=os.environ.get('YTDL_POOL', 'process'),
+                              workers=int(os.environ.get('YTDL_WORKERS', 0)) or None,
+                              per_guild=int(os.environ.get('YTDL_PER_GUILD', 2)),
+                              max_pending=int(os.environ.get('YTDL_MAX_PENDING', 64)),
+                              timeout=float(os.environ.get('YTDL_TIMEOUT', 30)))
+
+    # Stream URLs are signed and expire long before the rest of the
+    # metadata does, so they are refreshed a little ahead of time.
+    STREAM_EXPIRY_MARGIN = 5 * 60
+
+    search_cache = TTLCache(maxsize=1024, ttl=6 * 60 * 60)
+    info_cache = TTLCache(maxsize=4096, ttl=6 * 60 * 60)
+    stream_refreshes = 0
+
+    def __init__(self, source: discord.AudioSource, *, track: Track, volume: float = 0.5):
+        super().__init__(source, volume)
+
+        self.track = track
+
+    def __str__(self):
+        return str(self.track)
+
+    def fill(self, count: int):
+        self.original.fill(count)
+
+    @property
+    def elapsed(self):
+        return self.original.elapsed
+
+    def with_volume(self, volume: float):
+        self.volume = volume
+        return self
+
+    @classmethod
+    def create_source(cls, track: Track, *, volume: float = 0.5, start: float = 0.0):
+        """Starts ffmpeg on the track's stream, ``start`` seconds in. Only done right before it plays."""
+
+        if cls.PLAYBACK_ENGINE == 'opus':
+            return OpusSource(track, volume=volume, start=start)
+
+        source = BufferedAudio(discord.FFmpegPCMAudio(track.stream_url, **cls.ffmpeg_options(track, start=start)),
+                               start=start)
+        return cls(source, track=track, volume=volume)
+
+    @classmethod
+    def ffmpeg_options(cls, track: Track, *, start: float = 0.0):
+        options = cls.FFMPEG_OPTIONS
+        if os.path.isabs(track.stream_url):
+            # A file from the audio cache; the reconnect options only exist for network inputs.
+            options = dict(options, before_options='')
+        if start:
+            options = dict(options, before_options='{} -ss {:.2f}'.format(options['before_options'], start).strip())
+        return options
+
+    @classmethod
+    async def find(cls, ctx: commands.Context, search: str):
+        """Resolves a search string or URL to a Track."""
+
+        webpage_url = cls.search_cache.get(search)
+        if webpage_url is None:
+            webpage_url = await cls.search(search, guild_id=ctx.guild.id)
+            cls.search_cache.put(search, webpage_url)
+
+        return await cls.resolve(webpage_url, guild_id=ctx.guild.id)
+
+    @classmethod
+    async def search(cls, search: str, *, guild_id: int = None):
+        """Turns a search string or URL into the webpage URL of the first match."""
+
+        data = await cls.engine.extract(guild_id, search, process=False)
+
+        if data is None:
+            raise YTDLError('Couldn\'t find anything that matches `{}`'.format(search))
+
+        if 'entries' not in data:
+            process_info = data
+        else:
+            process_info = None
+            for entry in data['entries']:
+                if entry:
+                    process_info = entry
+                    break
+
+            if process_info is None:
+                raise YTDLError('Couldn\'t find anything that matches `{}`'.format(search))
+
+        return process_info['webpage_url']
+
+    @classmethod
+    async def resolve(cls, webpage_url: str, *, guild_id: int = None):
+        """Returns the Track for ``webpage_url`` with a stream URL that is still valid.
+
+        Cached tracks are reused as long as their stream URL has not expired.
+        """
+
+        cached = cls.info_cache.get(webpage_url)
+        if cached is not None:
+            if cls.stream_is_fresh(cached):
+                return cached
+
+            cls.stream_refreshes += 1
+
+        processed_info = await cls.engine.extract(guild_id, webpage_url)
+
+        if processed_info is None:
+            raise YTDLError('Couldn\'t fetch `{}`'.format(webpage_url))
+
+        if 'entries' not in processed_info:
+            info = processed_info
+        else:
+            info = None
+            while info is None:
+                try:
+                    info = processed_info['entries'].pop(0)
+                except IndexError:
+                    raise YTDLError('Couldn\'t retrieve any matches for `{}`'.format(webpage_url))
+
+        track = Track.from_info(info, stream_expires_at=cls.stream_expiry(info['url']))
+        cls.info_cache.put(webpage_url, track)
+        return track
+
+    @classmethod
+    def stream_is_fresh(cls, track: Track) -> bool:
+        return track.stream_url is not None and track.stream_expires_at - cls.STREAM_EXPIRY_MARGIN > time.time()
+
+    @staticmethod
+    def is_playlist(search: str) -> bool:
+        parsed = urllib.parse.urlparse(search)
+        if parsed.scheme not in ('http', 'https'):
+            return False
+
+        return 'list' in urllib.parse.parse_qs(parsed.query) or parsed.path.rstrip('/').endswith('/playlist')
+
+    @classmethod
+    async def playlist_pages(cls, url: str, *, guild_id: int = None):
+        """Yields the playlist as lists of ``(title, webpage_url)``, one page at a time.
+
+        Entries are listed without being resolved, so a page costs about
+        as much as one search.
+        """
+
+        start = 1
+        while start <= cls.PLAYLIST_LIMIT:
+            end = min(start + cls.PLAYLIST_PAGE, cls.PLAYLIST_LIMIT + 1) - 1
+            data = await cls.engine.extract(guild_id, url, options=cls.PLAYLIST_OPTIONS,
+                                            params={'playliststart': start, 'playlistend': end})
+            if data is None:
+                raise YTDLError('Couldn\'t fetch `{}`'.format(url))
+
+            entries = [entry for entry in data.get('entries') or () if entry]
+            if entries:
+                yield [(entry.get('title'), cls._entry_url(entry)) for entry in entries]
+
+            if 'entries' not in data or len(data['entries']) < end - start + 1:
+                return
+            start = end + 1
+
+    @staticmethod
+    def _entry_url(entry: dict) -> str:
+        url = entry.get('webpage_url') or entry.get('url')
+        if entry.get('ie_key') == 'Youtube' and not url.startswith(('http://', 'https://')):
+            # Flat YouTube entries only carry the video id.
+            url = 'https://www.youtube.com/watch?v=' + entry.get('id', url)
+        return url
+
+    @classmethod
+    def stream_expiry(cls, stream_url: str) -> float:
+        """Reads the expiry timestamp signed into googlevideo-style stream URLs."""
+
+        parsed = urllib.parse.urlparse(stream_url)
+        expire = urllib.parse.parse_qs(parsed.query).get('expire')
+        if expire:
+            expire = expire[0]
+        else:
+            # Manifest URLs carry it as a path segment: .../expire/1623456789/...
+            parts = parsed.path.split('/')
+            if 'expire' in parts[:-1]:
+                expire = parts[parts.index('expire') + 1]
+
+        try:
+            return float(expire)
+        except (TypeError, ValueError):
+            return time.time() + cls.info_cache.ttl
+
+    @classmethod
+    def cache_stats(cls):
+        return {
+            'search': cls.search_cache.stats(),
+            'info': cls.info_cache.stats(),
+            'stream_refreshes': cls.stream_refreshes,
+        }
+
+    @staticmethod
+    def parse_duration(duration: int):
+        minutes, seconds = divmod(duration, 60)
+        hours, minutes = divmod(minutes, 60)
+        days, hours = divmod(hours, 24)
+
+        duration = []
+        if days > 0:
+            duration.append('{} дней'.format(days))
+        if hours > 0:
+            duration.append('{} часов'.format(hours))
+        if minutes > 0:
+            duration.append('{} минут'.format(minutes))
+        if seconds > 0:
+            duration.append('{} секунд'.format(seconds))
+
+        return ', '.join(duration)
+
+
+class AudioCache(JsonStore):
+    """Keeps frequently played tracks on disk as Opus files.
+
+    Once a track has been played ``min_plays`` times it is downloaded
+    once and later plays read the local file instead of the network. The
+    cache stays under ``max_bytes`` by evicting the least recently played
+    files. Every file is stored under its SHA-256 and checked against it
+    before the first use after a restart. The index of files and play
+    counts lives in ``index.json`` inside the cache directory.
+    """
+
+    MAX_PLAY_COUNTS = 10000
+
+    def __init__(self, directory: str, *, max_bytes: int, min_plays: int = 3, flush_interval: float = 60):
+        self.directory = os.path.abspath(directory)
+        super().__init__(os.path.join(self.directory, 'index.json'))
+        self.max_bytes = max_bytes
+        self.min_plays = min_plays
+        self.flush_interval = flush_interval
+
+        self.hits = 0
+        self.total_bytes = 0
+        self._entries = collections.OrderedDict()
+        self._plays = collections.OrderedDict()
+        self._verified = set()
+        self._downloading = set()
+        self._tasks = []
+
+        if not self.enabled:
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        saved = self.load({})
+        for url, entry in saved.get('files', []):
+            self._entries[url] = entry
+            self.total_bytes += entry['size']
+        self._plays.update(saved.get('plays', []))
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _path(self, entry: dict):
+        return os.path.join(self.directory, entry['file'])
+
+    def lookup(self, url: str):
+        """Returns a Track playing from the local copy of ``url``, if there is a checked one."""
+
+        entry = self._entries.get(url)
+        if entry is None or url not in self._verified:
+            return None
+
+        self._entries.move_to_end(url)
+        self._dirty = True
+        self.hits += 1
+
+        track = entry['track']
+        return Track(track['title'], url,
+                     uploader=track['uploader'],
+                     uploader_url=track['uploader_url'],
+                     duration=track['duration'],
+                     thumbnail=track['thumbnail'],
+                     stream_url=self._path(entry),
+                     stream_expires_at=float('inf'),
+                     codec='opus')
+
+    def played(self, track: Track, *, guild_id: int = None):
+        if not self.enabled or track.url in self._entries or track.url in self._downloading:
+            return
+
+        plays = self._plays.pop(track.url, 0) + 1
+        self._plays[track.url] = plays
+        while len(self._plays) > self.MAX_PLAY_COUNTS:
+            self._plays.popitem(last=False)
+        self._dirty = True
+
+        if plays >= self.min_plays:
+            self._downloading.add(track.url)
+            self._tasks.append(asyncio.get_event_loop().create_task(self._download(track, guild_id)))
+
+    async def _download(self, track: Track, guild_id: int):
+        options = dict(YTDLSource.YTDL_OPTIONS,
+                       outtmpl=os.path.join(self.directory, '.download-%(id)s.%(ext)s'),
+                       postprocessors=[{'key': 'FFmpegExtractAudio', 'preferredcodec': 'opus'}])
+        try:
+            name, size, digest = await YTDLSource.engine.download(guild_id, track.url, self.directory, options=options)
+        except YTDLError as e:
+            log.warning('Caching %s failed: %s', track.url, e)
+            return
+        finally:
+            self._downloading.discard(track.url)
+            self._tasks = [task for task in self._tasks if not task.done()]
+
+        self._entries[track.url] = {
+            'file': name,
+            'size': size,
+            'sha256': digest,
+            'track': {
+                'title': track.title,
+                'uploader': track.uploader,
+                'uploader_url': track.uploader_url,
+                'duration': track.duration,
+                'thumbnail': track.thumbnail,
+            },
+        }
+        self._verified.add(track.url)
+        self._plays.pop(track.url, None)
+        self.total_bytes += size
+        self._dirty = True
+        self._evict()
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            url, entry = self._entries.popitem(last=False)
+            self._drop_file(url, entry)
+
+    def _drop_file(self, url: str, entry: dict):
+        self._verified.discard(url)
+        self.total_bytes -= entry['size']
+        self._dirty = True
+        # Files are named by content, another entry may share it.
+        if not any(other['file'] == entry['file'] for other in self._entries.values()):
+            try:
+                os.remove(self._path(entry))
+            except FileNotFoundError:
+                pass
+
+    def _check(self, entry: dict) -> bool:
+        digest = hashlib.sha256()
+        try:
+            with open(self._path(entry), 'rb') as f:
+                for chunk in iter(functools.partial(f.read, 1 << 16), b''):
+                    digest.update(chunk)
+        except FileNotFoundError:
+            return False
+        return digest.hexdigest() == entry['sha256']
+
+    async def _verify(self):
+        loop = asyncio.get_event_loop()
+        for url, entry in list(self._entries.items()):
+            if await loop.run_in_executor(None, self._check, entry):
+                self._verified.add(url)
+            elif self._entries.get(url) is entry:
+                log.warning('Dropping corrupt cached audio for %s', url)
+                del self._entries[url]
+                self._drop_file(url, entry)
+
+    def _data(self):
+        return {'files': list(self._entries.items()), 'plays': list(self._plays.items())}
+
+    def stats(self):
+        return {'files': len(self._entries), 'bytes': self.total_bytes, 'hits': self.hits,
+                'downloading': len(self._downloading)}
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if self.enabled and self._task is None:
+            self._tasks.append(loop.create_task(self._verify()))
+            super().start(loop)
+
+    async def close(self):
+        for task in self._tasks:
+            task.cancel()
+        self._tasks = []
+
+        await super().close()
+
+
+class Song:
+    __slots__ = ('track', 'requester', 'channel', 'source', 'prefetch', 'start', '_embed')
+
+    def __init__(self, track: Track, requester: discord.Member, channel: discord.abc.Messageable, *,
+                 start: float = 0.0):
+        self.track = track
+        self.requester = requester
+        self.channel = channel
+        self.source = None
+        self.prefetch = None
+        # Where the next playback begins; only set for songs restored mid-way.
+        self.start = start
+        self._embed = None
+
+    def __str__(self):
+        return str(self.track)
+
+    async def prepare(self, *, buffer_frames: int = 0, volume: float = 0.5):
+        """Gets the song ready to play right away.
+
+        Makes sure the track has a stream URL that is still valid, starts
+        ffmpeg on it and optionally lets ffmpeg decode the first
+        ``buffer_frames`` frames. Songs queued from a playlist get
+        resolved for the first time here.
+        """
+
+        track = audio_cache.lookup(self.track.url)
+        if track is None:
+            track = await YTDLSource.resolve(self.track.url, guild_id=self.channel.guild.id)
+        source = YTDLSource.create_source(track, volume=volume, start=self.start)
+        if buffer_frames:
+            try:
+                await asyncio.get_event_loop().run_in_executor(None, source.fill, buffer_frames)
+            except BaseException:
+                source.cleanup()
+                raise
+
+        if self.source is not None:
+            self.source.cleanup()
+        if track is not self.track:
+            self._embed = None
+        self.track = track
+        self.source = source
+        self.start = 0.0
+
+    def set_volume(self, volume: float, voice: discord.VoiceClient = None):
+        if self.source is None:
+            return
+
+        source = self.source.with_volume(volume)
+        if source is not self.source:
+            # The Opus engine had to restart ffmpeg; swap it in mid-song.
+            if voice is not None and voice.source is self.source:
+                voice.source = source
+            self.source.cleanup()
+            self.source = source
+
+    def cleanup(self):
+        if self.prefetch is not None:
+            self.prefetch.cancel()
+            self.prefetch = None
+        if self.source is not None:
+            self.source.cleanup()
+            self.source = None
+
+    def create_embed(self):
+        """Returns the song's embed, built once and reused until the track changes."""
+
+        if self._embed is not None:
+            return self._embed
+
+        self._embed = (discord.Embed(title='Опа,смотри что играет',
+                                     description='```css\n{0.track.title}\n```'.format(self),
+                                     color=discord.Color.blurple())
+                       .add_field(name='Время прослушивания', value=YTDLSource.parse_duration(self.track.duration))
+                       .add_field(name='Запросил', value=self.requester.mention)
+                       .add_field(name='Автор видео', value='[{0.track.uploader}]({0.track.uploader_url})'.format(self))
+                       .add_field(name='Ссылка(кликни)', value='[Click]({0.track.url})'.format(self))
+                       .set_thumbnail(url=self.track.thumbnail))
+
+        return self._embed
+
+
+class _TreapNode:
+    __slots__ = ('value', 'priority', 'size', 'left', 'right')
+
+    def __init__(self, value):
+        self.value = value
+        self.priority = random.random()
+        self.size = 1
+        self.left = None
+        self.right = None
+
+
+def _size(node):
+    return node.size if node is not None else 0
+
+
+def _update(node):
+    node.size = 1 + _size(node.left) + _size(node.right)
+
+
+def _split(node, count):
+    """Splits off the first ``count`` items, returns (head, tail)."""
+
+    if node is None:
+        return None, None
+
+    if _size(node.left) >= count:
+        head, node.left = _split(node.left, count)
+        _update(node)
+        return head, node
+
+    node.right, tail = _split(node.right, count - _size(node.left) - 1)
+    _update(node)
+    return node, tail
+
+
+def _merge(head, tail):
+    if head is None:
+        return tail
+    if tail is None:
+        return head
+
+    if head.priority > tail.priority:
+        head.right = _merge(head.right, tail)
+        _update(head)
+        return head
+
+    tail.left = _merge(head, tail.left)
+    _update(tail)
+    return tail
+
+
+class IndexedList:
+    """A sequence with O(log n) access, insertion and removal by position.
+
+    Backed by an implicit treap: a randomly balanced binary tree where
+    each node's position is given by the sizes of the subtrees to its
+    left, so positional operations never shift the items behind them.
+    """
+
+    def __init__(self, iterable=()):
+        self._root = None
+        self.replace(iterable)
+
+    def __len__(self):
+        return _size(self._root)
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def _index(self, index: int, *, clamp: bool = False):
+        length = len(self)
+        if index < 0:
+            index += length
+        if clamp:
+            return min(max(index, 0), length)
+        if not 0 <= index < length:
+            raise IndexError('IndexedList index out of range')
+        return index
+
+    def __getitem__(self, index: int):
+        index = self._index(index)
+        node = self._root
+        while True:
+            left = _size(node.left)
+            if index < left:
+                node = node.left
+            elif index == left:
+                return node.value
+            else:
+                index -= left + 1
+                node = node.right
+
+    def iter_from(self, start: int):
+        """Iterates from position ``start`` on, in O(log n) plus O(1) per item."""
+
+        stack = []
+        node = self._root
+        while node is not None:
+            left = _size(node.left)
+            if start < left:
+                stack.append(node)
+                node = node.left
+            elif start == left:
+                stack.append(node)
+                break
+            else:
+                start -= left + 1
+                node = node.right
+
+        while stack:
+            node = stack.pop()
+            yield node.value
+
+            node = node.right
+            while node is not None:
+                stack.append(node)
+                node = node.left
+
+    def insert(self, index: int, value):
+        head, tail = _split(self._root, self._index(index, clamp=True))
+        self._root = _merge(_merge(head, _TreapNode(value)), tail)
+
+    def append(self, value):
+        self._root = _merge(self._root, _TreapNode(value))
+
+    def pop(self, index: int = -1):
+        head, rest = _split(self._root, self._index(index))
+        node, tail = _split(rest, 1)
+        self._root = _merge(head, tail)
+        return node.value
+
+    def popleft(self):
+        return self.pop(0)
+
+    def clear(self):
+        self._root = None
+
+    def replace(self, iterable):
+        """Replaces the contents in O(n), building the tree bottom-up."""
+
+        stack = []
+        for value in iterable:
+            node = _TreapNode(value)
+            last = None
+            while stack and stack[-1].priority < node.priority:
+                last = stack.pop()
+            node.left = last
+            if stack:
+                stack[-1].right = node
+            stack.append(node)
+
+        self._root = stack[0] if stack else None
+        self._fix_sizes(self._root)
+
+    def _fix_sizes(self, node):
+        if node is not None:
+            self._fix_sizes(node.left)
+            self._fix_sizes(node.right)
+            _update(node)
+
+
+class SortedIndex(IndexedList):
+    """An IndexedList kept in ascending order, with O(log n) rank lookups."""
+
+    def bisect(self, value) -> int:
+        """The number of items smaller than ``value``."""
+
+        index = 0
+        node = self._root
+        while node is not None:
+            if node.value < value:
+                index += _size(node.left) + 1
+                node = node.right
+            else:
+                node = node.left
+        return index
+
+    def add(self, value):
+        self.insert(self.bisect(value), value)
+
+    def remove(self, value):
+        index = self.bisect(value)
+        if index == len(self) or self[index] != value:
+            raise ValueError('{!r} is not in the index'.format(value))
+        self.pop(index)
+
+
+class SongQueue(asyncio.Queue):
+    """asyncio.Queue kept in an IndexedList.
+
+    get() still waits for a song to arrive, while the queue commands can
+    look up, move and remove songs by position in O(log n).
+
+    ``version`` goes up on every change. The rendered text of each page of
+    ``!queue`` is kept until a change touches a position on that page.
+    """
+
+    PAGE_SIZE = 10
+
+    # The first ``prefetch_depth`` songs may hold a running ffmpeg; a song
+    # that gets moved out of them has it stopped.
+    prefetch_depth = 0
+
+    def _init(self, maxsize):
+        self._queue = IndexedList()
+        self._pages = {}
+        self.version = 0
+
+    def _put(self, item):
+        self._queue.append(item)
+        self._invalidate(len(self._queue) - 1)
+
+    def _get(self):
+        self._invalidate()
+        return self._queue.popleft()
+
+    def _invalidate(self, start: int = 0, stop: int = None):
+        """Forgets the pages holding positions ``start`` to ``stop`` (inclusive, None for the end)."""
+
+        self.version += 1
+        first = start // self.PAGE_SIZE
+        last = None if stop is None else stop // self.PAGE_SIZE
+        for page in [page for page in self._pages if page >= first and (last is None or page <= last)]:
+            del self._pages[page]
+
+    @property
+    def pages(self):
+        return max(math.ceil(len(self) / self.PAGE_SIZE), 1)
+
+    def render_page(self, page: int) -> str:
+        """Returns the lines of ``!queue`` for a zero-based page."""
+
+        text = self._pages.get(page)
+        if text is None:
+            start = page * self.PAGE_SIZE
+            text = ''.join('`{0}.` [**{1.track.title}**]({1.track.url})\n'.format(i + 1, song)
+                           for i, song in enumerate(self[start:start + self.PAGE_SIZE], start=start))
+            self._pages[page] = text
+        return text
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            start, stop, step = item.indices(len(self))
+            if step != 1:
+                return list(self._queue)[item]
+            return list(itertools.islice(self._queue.iter_from(start), max(stop - start, 0)))
+        else:
+            return self._queue[item]
+
+    def __iter__(self):
+        return self._queue.__iter__()
+
+    def __len__(self):
+        return self.qsize()
+
+    def _release(self, head: list):
+        """Cleans up the songs of ``head``, the former first places, that are no longer among them."""
+
+        kept = set(self[:self.prefetch_depth])
+        for song in head:
+            if song not in kept:
+                song.cleanup()
+
+    def clear(self):
+        for song in self._queue:
+            song.cleanup()
+        self._queue.clear()
+        self._invalidate()
+
+    def shuffle(self, seed: int = None) -> int:
+        """Shuffles the queue; the same seed on the same queue gives the same order."""
+
+        if seed is None:
+            seed = random.randrange(1000000)
+
+        songs = list(self._queue)
+        head = songs[:self.prefetch_depth]
+        random.Random(seed).shuffle(songs)
+        self._queue.replace(songs)
+        self._invalidate()
+        self._release(head)
+        return seed
+
+    def remove(self, index: int):
+        self._queue.pop(index).cleanup()
+        self._invalidate(index)
+
+    def move(self, index: int, destination: int):
+        head = self[:self.prefetch_depth]
+        self._queue.insert(destination, self._queue.pop(index))
+        self._invalidate(min(index, destination), max(index, destination))
+        self._release(head)
+
+    def insert(self, index: int, song):
+        # put_nowait takes care of waking up a waiting get().
+        self.put_nowait(song)
+        self.move(len(self) - 1, index)
+
+    def dedupe(self) -> int:
+        """Drops every song already queued earlier under the same URL."""
+
+        seen = set()
+        kept = []
+        for song in self._queue:
+            if song.track.url in seen:
+                song.cleanup()
+            else:
+                seen.add(song.track.url)
+                kept.append(song)
+
+        removed = len(self._queue) - len(kept)
+        if removed:
+            self._queue.replace(kept)
+            self._invalidate()
+        return removed
+
+
+class VoiceState:
+    # How many upcoming songs get their stream refreshed while the
+    # current one plays, and how much of each ffmpeg decodes up front.
+    PREFETCH_DEPTH = int(os.environ.get('PREFETCH_DEPTH', 1))
+    PREBUFFER_FRAMES = int(float(os.environ.get('PREBUFFER_SECONDS', 1)) * 50)
+
+    def __init__(self, bot: commands.Bot, ctx: commands.Context):
+        self.bot = bot
+        self._ctx = ctx
+
+        self.current = None
+        self.voice = None
+        self.next = asyncio.Event()
+        self.songs = SongQueue()
+        self.songs.prefetch_depth = self.PREFETCH_DEPTH
+
+        self._loop = False
+        self._volume = 0.5
+        self.skip_votes = set()
+        self.playlist_loader = None
+        self.idle_since = None
+
+        # Started by the first command that actually plays something.
+        self.audio_player = None
+
+    def start(self):
+        """Starts the player, or starts it again if it ended."""
+
+        if self.audio_player is not None and not self.audio_player.done():
+            return
+
+        if self.audio_player is not None:
+            if not self.audio_player.cancelled() and self.audio_player.exception() is not None:
+                log.error('Player stopped, starting it again', exc_info=self.audio_player.exception())
+            if self.voice is not None and self.voice.is_playing():
+                self.voice.stop()
+            if self.current is not None:
+                self.current.cleanup()
+                self.current = None
+
+        self.audio_player = self.bot.loop.create_task(self.audio_player_task())
+
+    @property
+    def is_connected(self):
+        return self.voice is not None and self.voice.is_connected()
+
+    @property
+    def is_idle(self):
+        """True while there is nothing to play and nothing on its way."""
+
+        if not self.is_connected:
+            return True
+        return (self.current is None and len(self.songs) == 0
+                and (self.playlist_loader is None or self.playlist_loader.done()))
+
+    @property
+    def loop(self):
+        return self._loop
+
+    @loop.setter
+    def loop(self, value: bool):
+        self._loop = value
+
+    @property
+    def volume(self):
+        return self._volume
+
+    @volume.setter
+    def volume(self, value: float):
+        self._volume = value
+        if self.current is not None:
+            self.current.set_volume(value, self.voice)
+
+    @property
+    def is_playing(self):
+        return self.voice and self.current
+
+    async def audio_player_task(self):
+        while True:
+            self.next.clear()
+            if not self.is_connected:
+                # Disconnected from outside; the Music supervisor drops this player.
+                return
+
+            replay = self.loop and self.current is not None
+
+            if not replay:
+                # Waiting here costs nothing; the Music supervisor
+                # disconnects players that stay idle for too long.
+                self.current = None
+                self.current = await self.songs.get()
+
+            try:
+                await self._ready(self.current, replay=replay)
+                self.current.set_volume(self._volume)
+                self.voice.play(self.current.source, after=self.play_next_song)
+            except Exception as e:
+                if not self.is_connected:
+                    # Not the song's fault, the rest of the queue would fail the same way.
+                    return
+
+                # One broken song must not take the rest of the queue down with it.
+                if not isinstance(e, YTDLError):
+                    log.exception('Failed to start %s', self.current.track.url)
+                try:
+                    await self.current.channel.send('Не получилось включить {}: {}'.format(self.current, e))
+                except discord.HTTPException:
+                    pass
+                self.current.cleanup()
+                self.current = None
+                self.loop = False
+                continue
+
+            self.prefetch()
+            audio_cache.played(self.current.track, guild_id=self.current.channel.guild.id)
+            await self.current.channel.send(embed=self.current.create_embed())
+
+            await self.next.wait()
+
+    async def _ready(self, song: Song, *, replay: bool = False):
+        task, song.prefetch = song.prefetch, None
+        if task is not None:
+            await asyncio.wait([task])
+            if task.cancelled() or task.exception() is not None:
+                log.warning('Prefetching %s failed, retrying before playback', song.track.url)
+            elif YTDLSource.stream_is_fresh(song.track):
+                return
+        elif not replay and song.source is not None and YTDLSource.stream_is_fresh(song.track):
+            return
+
+        # Not started yet, used up by looping, or sitting on an expired URL,
+        # which a prefetched song can be after waiting long enough.
+        await song.prepare(volume=self._volume)
+
+    def prefetch(self):
+        """Starts preparing the next songs in the background while one plays."""
+
+        if not self.is_playing:
+            return
+
+        for song in self.songs[:self.PREFETCH_DEPTH]:
+            if song.prefetch is None:
+                song.prefetch = self.bot.loop.create_task(song.prepare(buffer_frames=self.PREBUFFER_FRAMES,
+                                                                             volume=self._volume))
+
+    def play_next_song(self, error=None):
+        if error:
+            raise VoiceError(str(error))
+
+        self.next.set()
+
+    def skip(self):
+        self.skip_votes.clear()
+
+        if self.is_playing:
+            self.voice.stop()
+
+    def load_playlist(self, ctx: commands.Context, url: str):
+        if self.playlist_loader is not None and not self.playlist_loader.done():
+            raise VoiceError('Плейлист уже загружается, дождитесь окончания или используйте !stop')
+
+        self.playlist_loader = self.bot.loop.create_task(self._load_playlist(ctx, url))
+
+    def cancel_playlist(self):
+        if self.playlist_loader is not None:
+            self.playlist_loader.cancel()
+            self.playlist_loader = None
+
+    async def _load_playlist(self, ctx: commands.Context, url: str):
+        message = await ctx.send('Загружаю плейлист...')
+        added = 0
+        try:
+            async for entries in YTDLSource.playlist_pages(url, guild_id=ctx.guild.id):
+                for title, webpage_url in entries:
+                    await self.songs.put(Song(Track(title, webpage_url), ctx.author, ctx.channel))
+                added += len(entries)
+                self.start()
+                self.prefetch()
+                await message.edit(content='Загружаю плейлист... добавлено {} треков'.format(added))
+        except YTDLError as e:
+            await ctx.send('Произошла ошибка при загрузке плейлиста: {}'.format(str(e)))
+        except asyncio.CancelledError:
+            await message.edit(content='Загрузка плейлиста остановлена, добавлено {} треков'.format(added))
+            raise
+        else:
+            await message.edit(content='Плейлист добавлен: {} треков'.format(added))
+
+    async def stop(self):
+        self.cancel_playlist()
+        self.songs.clear()
+
+        if self.audio_player is not None:
+            self.audio_player.cancel()
+            self.audio_player = None
+        if self.current is not None:
+            self.current.cleanup()
+            self.current = None
+
+        if self.voice:
+            await self.voice.disconnect()
+            self.voice = None
+
+
+class NotPlaying(commands.CommandError):
+    pass
+
+
+class Music(commands.Cog):
+    # Reactions that flip the !queue pages, and how long they keep working.
+    PAGE_EMOJIS = {'◀': -1, '▶': 1}
+    PAGINATOR_TIMEOUT = 60
+
+    # Only these commands set up a player; the rest just look at one.
+    PLAYER_COMMANDS = {'join', 'summon', 'play', 'insert'}
+
+    # A player with nothing to do is disconnected after IDLE_TIMEOUT
+    # seconds; the supervisor looks every SUPERVISOR_INTERVAL seconds.
+    IDLE_TIMEOUT = int(os.environ.get('PLAYER_IDLE_TIMEOUT', 180))
+    SUPERVISOR_INTERVAL = 30
+
+    def __init__(self, bot: commands.Bot):
+        self.bot = bot
+        self.voice_states = {}
+        self.paginators = set()
+        self.reaped = 0
+        self.supervisor = bot.loop.create_task(self._supervise())
+
+    def get_voice_state(self, ctx: commands.Context, *, create: bool = True):
+        state = self.voice_states.get(ctx.guild.id)
+        if not state and create:
+            state = VoiceState(self.bot, ctx)
+            self.voice_states[ctx.guild.id] = state
+
+        return state
+
+    async def drop_voice_state(self, guild_id: int):
+        state = self.voice_states.pop(guild_id, None)
+        if state is not None:
+            YTDLSource.engine.cancel(guild_id)
+            await state.stop()
+
+    async def _supervise(self):
+        """Disconnects players that have been idle for IDLE_TIMEOUT seconds.
+
+        Also catches voice clients that got disconnected from outside,
+        e.g. by a moderator, and forgets their state right away.
+        """
+
+        await self.bot.wait_until_ready()
+        while True:
+            now = time.monotonic()
+            for guild_id, state in list(self.voice_states.items()):
+                if state.voice is not None and not state.is_connected:
+                    log.info('Dropping disconnected player in guild %s', guild_id)
+                    try:
+                        await self.drop_voice_state(guild_id)
+                    except Exception:
+                        log.exception('Failed to stop the player in guild %s', guild_id)
+                    continue
+
+                if state.audio_player is not None and state.audio_player.done():
+                    # Whatever ended it, the queue would otherwise never move again.
+                    state.start()
+
+                if not state.is_idle:
+                    state.idle_since = None
+                elif state.idle_since is None:
+                    state.idle_since = now
+                elif now - state.idle_since >= self.IDLE_TIMEOUT:
+                    log.info('Dropping idle player in guild %s', guild_id)
+                    self.reaped += 1
+                    try:
+                        await self.drop_voice_state(guild_id)
+                    except Exception:
+                        log.exception('Failed to stop the player in guild %s', guild_id)
+
+            await asyncio.sleep(self.SUPERVISOR_INTERVAL)
+
+    def stats(self):
+        return {
+            'voice_states': len(self.voice_states),
+            'players': sum(1 for state in self.voice_states.values()
+                           if state.audio_player is not None and not state.audio_player.done()),
+            'queued_songs': sum(len(state.songs) for state in self.voice_states.values()),
+            # Every song with a source holds an ffmpeg process, wherever it is queued.
+            'ffmpeg_processes': sum(1 for state in self.voice_states.values()
+                                    for song in itertools.chain([state.current], state.songs)
+                                    if song is not None and song.source is not None),
+            'paginators': len(self.paginators),
+            'reaped': self.reaped,
+            'tasks': len(asyncio.all_tasks(self.bot.loop)),
+            'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+
+    def cog_unload(self):
+        self.supervisor.cancel()
+        for task in list(self.paginators):
+            task.cancel()
+        for guild_id in list(self.voice_states):
+            self.bot.loop.create_task(self.drop_voice_state(guild_id))
+
+    def cog_check(self, ctx: commands.Context):
+        if not ctx.guild:
+            raise commands.NoPrivateMessage('Эта команда не используется в ЛС (Личные сообщения)')
+
+        return True
+
+    async def cog_before_invoke(self, ctx: commands.Context):
+        if ctx.command.name == 'musicstats':
+            return
+
+        ctx.voice_state = self.get_voice_state(ctx, create=ctx.command.name in self.PLAYER_COMMANDS)
+        if ctx.voice_state is None:
+            raise NotPlaying('Бот сейчас ничего не играет. Можете включить через !play')
+
+    async def cog_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        if isinstance(error, NotPlaying):
+            return await ctx.send(str(error))
+
+        await ctx.send('Меня это пугает. Произошла какая-то ошибка: {}'.format(str(error)))
+
+    @commands.command(name='join', invoke_without_subcommand=True)
+    async def _join(self, ctx: commands.Context):
+        """Joins a voice channel."""
+
+        destination = ctx.author.voice.channel
+        if ctx.voice_state.voice:
+            await ctx.voice_state.voice.move_to(destination)
+            return
+
+        ctx.voice_state.voice = await destination.connect()
+        ctx.voice_state.start()
+
+    @commands.command(name='summon')
+    @commands.has_permissions(manage_guild=True)
+    async def _summon(self, ctx: commands.Context, *, channel: discord.VoiceChannel = None):
+        """Summons the bot to a voice channel.
+        If no channel was specified, it joins your channel.
+        """
+
+        if not channel and not ctx.author.voice:
+            raise VoiceError('Вы не подключены к голосовому каналу. И не указали куда подключаться.')
+
+        destination = channel or ctx.author.voice.channel
+        if ctx.voice_state.voice:
+            await ctx.voice_state.voice.move_to(destination)
+            return
+
+        ctx.voice_state.voice = await destination.connect()
+        ctx.voice_state.start()
+
+    @commands.command(name='leave', aliases=['disconnect'])
+    @commands.has_permissions(manage_guild=True)
+    async def _leave(self, ctx: commands.Context):
+        """Clears the queue and leaves the voice channel."""
+
+        if not ctx.voice_state.voice:
+            return await ctx.send('Бот и так не подключен. Зачем его кикать?')
+
+        await self.drop_voice_state(ctx.guild.id)
+
+    @commands.command(name='volume')
+    async def _volume(self, ctx: commands.Context, *, volume: int):
+        """Sets the volume of the player."""
+
+        if not ctx.voice_state.is_playing:
+            return await ctx.send('Сейчас музыка не играет. Можете включить.')
+
+        if 0 > volume > 100:
+            return await ctx.send('Volume must be between 0 and 100')
+
+        ctx.voice_state.volume = volume / 100
+        await ctx.send('Громкость изменена на {}%'.format(volume))
+
+    @commands.command(name='now', aliases=['current', 'playing'])
+    async def _now(self, ctx: commands.Context):
+        """Displays the currently playing song."""
+
+        if ctx.voice_state.current is None:
+            return await ctx.send('Сейчас музыка не играет. Можете включить.')
+
+        await ctx.send(embed=ctx.voice_state.current.create_embed())
+
+    @commands.command(name='pause')
+    @commands.has_permissions(manage_guild=True)
+    async def _pause(self, ctx: commands.Context):
+        """Pauses the currently playing song."""
+
+        if not ctx.voice_state.is_playing and ctx.voice_state.voice.is_playing():
+            ctx.voice_state.voice.pause()
+            await ctx.message.add_reaction('⏯')
+
+    @commands.command(name='resume')
+    @commands.has_permissions(manage_guild=True)
+    async def _resume(self, ctx: commands.Context):
+        """Resumes a currently paused song."""
+
+        if not ctx.voice_state.is_playing and ctx.voice_state.voice.is_paused():
+            ctx.voice_state.voice.resume()
+            await ctx.message.add_reaction('⏯')
+
+    @commands.command(name='stop')
+    @commands.has_permissions(manage_guild=True)
+    async def _stop(self, ctx: commands.Context):
+        """Stops playing song and clears the queue."""
+
+        ctx.voice_state.cancel_playlist()
+        ctx.voice_state.songs.clear()
+        YTDLSource.engine.cancel(ctx.guild.id)
+
+        if not ctx.voice_state.is_playing:
+            ctx.voice_state.voice.stop()
+            await ctx.message.add_reaction('⏹')
+
+    @commands.command(name='skip')
+    async def _skip(self, ctx: commands.Context):
+        """Vote to skip a song. The requester can automatically skip.
+        3 skip votes are needed for the song to be skipped.
+        """
+
+        if not ctx.voice_state.is_playing:
+            return await ctx.send('Сейчас музыка не играет,зачем её пропускать? Можете включить.')
+
+        voter = ctx.message.author
+        if voter == ctx.voice_state.current.requester:
+            await ctx.message.add_reaction('⏭')
+            ctx.voice_state.skip()
+
+        elif voter.id not in ctx.voice_state.skip_votes:
+            ctx.voice_state.skip_votes.add(voter.id)
+            total_votes = len(ctx.voice_state.skip_votes)
+
+            if total_votes >= 3:
+                await ctx.message.add_reaction('⏭')
+                ctx.voice_state.skip()
+            else:
+                await ctx.send('Голосование за пропуск добавлено. Проголосовали: **{}/3**'.format(total_votes))
+
+        else:
+            await ctx.send('Вы уже голосовали за пропуск этого трека.')
+
+    @commands.command(name='musicstats')
+    @commands.is_owner()
+    async def _musicstats(self, ctx: commands.Context):
+        """Shows how many players, tasks and cached entries the bot holds."""
+
+        stats = dict(self.stats(), engine=YTDLSource.engine.stats(), cache=YTDLSource.cache_stats(),
+                     audio_cache=audio_cache.stats())
+        await ctx.send('```json\n{}\n```'.format(json.dumps(stats, indent=2)))
+
+    @commands.command(name='queue')
+    async def _queue(self, ctx: commands.Context, *, page: int = 1):
+        """Shows the player's queue.
+        You can optionally specify the page to show. Each page contains 10 elements.
+        The arrows under the message flip through the pages.
+        """
+
+        songs = ctx.voice_state.songs
+        if len(songs) == 0:
+            return await ctx.send('В очереди нет треков. Можете добавить.')
+
+        page = min(max(page, 1), songs.pages)
+        message = await ctx.send(embed=self._queue_embed(songs, page))
+        if songs.pages == 1:
+            return
+
+        # The page flips are handled in the background, the command is done once the page is out.
+        task = self.bot.loop.create_task(self._paginate(ctx, message, songs, page))
+        self.paginators.add(task)
+        task.add_done_callback(self.paginators.discard)
+
+    async def _paginate(self, ctx: commands.Context, message: discord.Message, songs: SongQueue, page: int):
+        try:
+            for emoji in self.PAGE_EMOJIS:
+                await message.add_reaction(emoji)
+        except discord.HTTPException:
+            # No permission to react, or the message is already gone.
+            return
+
+        def check(reaction, user):
+            return reaction.message.id == message.id and user == ctx.author and str(reaction) in self.PAGE_EMOJIS
+
+        while True:
+            try:
+                reaction, user = await self.bot.wait_for('reaction_add', check=check, timeout=self.PAGINATOR_TIMEOUT)
+            except asyncio.TimeoutError:
+                break
+
+            shown = (page, songs.version)
+            page += self.PAGE_EMOJIS[str(reaction)]
+            page = min(max(page, 1), songs.pages)
+            if (page, songs.version) != shown:
+                try:
+                    await message.edit(embed=self._queue_embed(songs, page))
+                except discord.NotFound:
+                    return
+
+            try:
+                await message.remove_reaction(reaction, user)
+            except discord.HTTPException:
+                pass
+
+        try:
+            await message.clear_reactions()
+        except discord.HTTPException:
+            pass
+
+    @staticmethod
+    def _queue_embed(songs: SongQueue, page: int):
+        return (discord.Embed(description='**{} tracks:**\n\n{}'.format(len(songs), songs.render_page(page - 1)))
+                .set_footer(text='Viewing page {}/{}'.format(page, songs.pages)))
+
+    @commands.command(name='shuffle')
+    async def _shuffle(self, ctx: commands.Context, seed: int = None):
+        """Shuffles the queue.
+        Shuffling the same queue with the same seed gives the same order.
+        """
+
+        if len(ctx.voice_state.songs) == 0:
+            return await ctx.send('В очереди нет треков. Можете добавить.')
+
+        seed = ctx.voice_state.songs.shuffle(seed)
+        ctx.voice_state.prefetch()
+        await ctx.message.add_reaction('✅')
+        await ctx.send('Очередь перемешана (seed: {})'.format(seed))
+
+    @commands.command(name='remove')
+    async def _remove(self, ctx: commands.Context, index: int):
+        """Removes a song from the queue at a given index."""
+
+        if len(ctx.voice_state.songs) == 0:
+            return await ctx.send('В очереди нет треков. Можете добавить.')
+
+        ctx.voice_state.songs.remove(index - 1)
+        await ctx.message.add_reaction('✅')
+
+    @commands.command(name='move')
+    async def _move(self, ctx: commands.Context, index: int, destination: int):
+        """Moves a song in the queue to another position."""
+
+        songs = ctx.voice_state.songs
+        if not (1 <= index <= len(songs) and 1 <= destination <= len(songs)):
+            return await ctx.send('В очереди нет трека с таким номером.')
+
+        songs.move(index - 1, destination - 1)
+        ctx.voice_state.prefetch()
+        await ctx.message.add_reaction('✅')
+
+    @commands.command(name='dedupe')
+    async def _dedupe(self, ctx: commands.Context):
+        """Removes repeated songs from the queue, keeping the first of each."""
+
+        removed = ctx.voice_state.songs.dedupe()
+        await ctx.send('Удалено повторов: {}'.format(removed))
+
+    @commands.command(name='loop')
+    async def _loop(self, ctx: commands.Context):
+        """Loops the currently playing song.
+        Invoke this command again to unloop the song.
+        """
+
+        if not ctx.voice_state.is_playing:
+            return await ctx.send('Ничего не играет в данный момент.')
+
+        # Inverse boolean value to loop and unloop.
+        ctx.voice_state.loop = not ctx.voice_state.loop
+        await ctx.message.add_reaction('✅')
+
+    @commands.command(name='play')
+    async def _play(self, ctx: commands.Context, *, search: str):
+        """Plays a song.
+        If there are songs in the queue, this will be queued until the
+        other songs finished playing.
+        This command automatically searches from various sites if no URL is provided.
+        A list of these sites can be found here: https://rg3.github.io/youtube-dl/supportedsites.html
+        """
+
+        if not ctx.voice_state.voice:
+            await ctx.invoke(self._join)
+
+        if YTDLSource.is_playlist(search):
+            return ctx.voice_state.load_playlist(ctx, search)
+
+        async with ctx.typing():
+            try:
+                track = await YTDLSource.find(ctx, search)
+            except YTDLError as e:
+                await ctx.send('Произошла ошибка при обработке этого запроса: {}'.format(str(e)))
+            else:
+                song = Song(track, ctx.author, ctx.channel)
+
+                await ctx.voice_state.songs.put(song)
+                ctx.voice_state.start()
+                ctx.voice_state.prefetch()
+                await ctx.send('Успешно добавлено {}'.format(str(track)))
+
+    @commands.command(name='insert')
+    async def _insert(self, ctx: commands.Context, index: int, *, search: str):
+        """Plays a song after the given number of queued songs."""
+
+        if not ctx.voice_state.voice:
+            await ctx.invoke(self._join)
+
+        async with ctx.typing():
+            try:
+                track = await YTDLSource.find(ctx, search)
+            except YTDLError as e:
+                await ctx.send('Произошла ошибка при обработке этого запроса: {}'.format(str(e)))
+            else:
+                ctx.voice_state.songs.insert(max(index - 1, 0), Song(track, ctx.author, ctx.channel))
+                ctx.voice_state.start()
+                ctx.voice_state.prefetch()
+                await ctx.send('Успешно добавлено {} на место {}'.format(str(track), index))
+
+    @_join.before_invoke
+    @_insert.before_invoke
+    @_play.before_invoke
+    async def ensure_voice_state(self, ctx: commands.Context):
+        if not ctx.author.voice or not ctx.author.voice.channel:
+            raise commands.CommandError('Сначала подключись к голосовому.')
+
+        if ctx.voice_client:
+            if ctx.voice_client.channel != ctx.author.voice.channel:
+                raise commands.CommandError('Бот уже подключен с голосовому каналу.')
+
+
+class Leaderboard:
+    """Wallets ordered by balance, updated on every change.
+
+    Entries are ``(-money, user id)`` in a SortedIndex, so the richest
+    come first and ties go to the lower id. Top-N costs O(log n + N) and a
+    user's rank O(log n).
+
+    The board is split into pages of ``page_size`` places. An update can
+    shift every place after the highest one it touched, so it marks that
+    page, and ``page_version`` is the latest mark on the page or any page
+    before it. The marks sit in a Fenwick tree that keeps prefix maxima,
+    so both sides cost O(log max_pages). Pages past ``max_pages`` share
+    the last version.
+    """
+
+    def __init__(self, balances=(), *, page_size: int = 10, max_pages: int = 1024):
+        self.page_size = page_size
+        self.max_pages = max_pages
+        self._updates = 0
+        self._marks = [0] * max_pages
+        self._index = SortedIndex(sorted((-money, user_id) for user_id, money in balances))
+
+    def __len__(self):
+        return len(self._index)
+
+    @property
+    def pages(self) -> int:
+        return max(-(-len(self._index) // self.page_size), 1)
+
+    def page_version(self, page: int) -> int:
+        """Changes whenever a place on the 1-based ``page`` may have changed."""
+
+        i = min(page, self.max_pages) - 1
+        version = 0
+        while i >= 0:
+            version = max(version, self._marks[i])
+            i = (i & (i + 1)) - 1
+        return version
+
+    def _mark(self, rank: int):
+        self._updates += 1
+        i = min(rank // self.page_size, self.max_pages - 1)
+        while i < self.max_pages:
+            # Update counts only grow, so this is the node's maximum.
+            self._marks[i] = self._updates
+            i |= i + 1
+
+    def update(self, user_id: int, old: int = None, new: int = None):
+        """Moves a user from balance ``old`` to ``new``; None means not on the board."""
+
+        ranks = []
+        if old is not None:
+            ranks.append(self._index.bisect((-old, user_id)))
+            self._index.remove((-old, user_id))
+        if new is not None:
+            self._index.add((-new, user_id))
+            ranks.append(self._index.bisect((-new, user_id)))
+
+        if ranks:
+            self._mark(min(ranks))
+
+    def top(self, count: int, offset: int = 0):
+        return [(user_id, -money) for money, user_id in itertools.islice(self._index.iter_from(offset), count)]
+
+    def rank(self, user_id: int, money: int) -> int:
+        return self._index.bisect((-money, user_id)) + 1
+
+
+class EconomyStore:
+    """Wallets and the role shop, kept in memory and backed by a ledger.
+
+    Every change is appended to ``<path>.ledger`` as one JSON line
+    (credit, debit, transfer, purchase, shop changes). Now and then the
+    in-memory state is compacted into the ``path`` snapshot and the
+    ledger starts over; on startup the snapshot is loaded and the ledger
+    tail replayed on top of it. Entries carry a sequence number and the
+    snapshot remembers the last one it includes, so a crash anywhere in
+    between never applies an entry twice.
+    """
+
+    # What other clusters may call through SharedStore.
+    SHARED_METHODS = ('balance', 'credit', 'debit', 'transfer', 'purchase', 'shop_items', 'shop_cost',
+                      'add_shop_item', 'remove_shop_item', 'leaderboard_page', 'top', 'rank')
+
+    def __init__(self, path: str, *, sync_interval: float = 5, compact_interval: float = 600,
+                 compact_threshold: int = 10000):
+        self.path = path
+        self.ledger_path = path + '.ledger'
+        self.sync_interval = sync_interval
+        self.compact_interval = compact_interval
+        self.compact_threshold = compact_threshold
+
+        self._data = {'shop': {}}
+        self._seq = 0
+        self._pending = 0
+        self._unsynced = False
+        self._last_compaction = time.monotonic()
+        self._locks = weakref.WeakValueDictionary()
+        self._task = None
+
+        self.leaderboard = None
+        self._recover()
+        self.leaderboard = Leaderboard((int(key), account['Money']) for key, account in self._data.items()
+                                       if key != 'shop')
+        self._ledger = open(self.ledger_path, 'a')
+
+    # Startup
+
+    def _recover(self):
+        try:
+            with open(self.path, 'r') as f:
+                self._data = json.load(f)
+        except FileNotFoundError:
+            pass
+
+        self._data.setdefault('shop', {})
+        self._seq = self._data.pop('_seq', 0)
+
+        for path in (self.ledger_path + '.old', self.ledger_path):
+            self._replay(path)
+
+        # Fold whatever was replayed into a fresh snapshot so every run
+        # starts from an empty ledger.
+        self._write_snapshot(self._snapshot())
+        open(self.ledger_path, 'w').close()
+        self._remove_old_ledger()
+
+    def _replay(self, path: str):
+        try:
+            f = open(path, 'r')
+        except FileNotFoundError:
+            return
+
+        with f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A torn write from a crash can only be the last line.
+                    log.warning('Skipping unreadable ledger entry in %s', path)
+                    continue
+
+                if entry['seq'] > self._seq:
+                    self._apply(entry)
+                    self._seq = entry['seq']
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if self._task is None:
+            self._task = loop.create_task(self._maintenance_loop())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+        # The loop is going away, there is no point in handing this to an executor.
+        self._write_snapshot(self._snapshot())
+        self._ledger.truncate(0)
+        self._ledger.close()
+        self._remove_old_ledger()
+
+    # Accounts
+
+    def balance(self, user_id: int) -> int:
+        account = self._data.get(str(user_id))
+        return account['Money'] if account else 0
+
+    def lock(self, *user_ids: int):
+        """Serializes changes to the given accounts.
+
+        Only needed when a command awaits something between checking a
+        balance and changing it. Locks are always taken in the same order
+        so two opposite transfers can't deadlock.
+        """
+
+        locks = []
+        for user_id in sorted(set(user_ids)):
+            lock = self._locks.get(user_id)
+            if lock is None:
+                lock = self._locks[user_id] = asyncio.Lock()
+            locks.append(lock)
+
+        return _AcquireAll(locks)
+
+    def leaderboard_page(self, page: int):
+        """Clamps ``page`` to the leaderboard and returns it with its version."""
+
+        page = min(max(page, 1), self.leaderboard.pages)
+        return page, self.leaderboard.page_version(page)
+
+    def top(self, count: int = 10, offset: int = 0):
+        return self.leaderboard.top(count, offset)
+
+    def rank(self, user_id: int):
+        """The user's place on the leaderboard and their balance, or None without a wallet."""
+
+        account = self._data.get(str(user_id))
+        if account is None:
+            return None
+        return self.leaderboard.rank(user_id, account['Money']), account['Money'], len(self.leaderboard)
+
+    @staticmethod
+    def _check_amount(amount: int):
+        # A negative credit or transfer would take coins without a balance check.
+        if amount <= 0:
+            raise ValueError('Amount must be positive, got {}'.format(amount))
+
+    def credit(self, user_id: int, amount: int):
+        self._check_amount(amount)
+        self._record({'op': 'credit', 'user': str(user_id), 'amount': amount})
+
+    def debit(self, user_id: int, amount: int) -> bool:
+        self._check_amount(amount)
+        if self.balance(user_id) < amount:
+            return False
+
+        self._record({'op': 'debit', 'user': str(user_id), 'amount': amount})
+        return True
+
+    async def transfer(self, sender_id: int, receiver_id: int, amount: int) -> bool:
+        self._check_amount(amount)
+        async with self.lock(sender_id, receiver_id):
+            if self.balance(sender_id) < amount:
+                return False
+
+            self._record({'op': 'transfer', 'from': str(sender_id), 'to': str(receiver_id), 'amount': amount})
+            return True
+
+    def purchase(self, user_id: int, role_id: int) -> bool:
+        cost = self.shop_cost(role_id)
+        if cost is None or self.balance(user_id) < cost:
+            return False
+
+        self._record({'op': 'purchase', 'user': str(user_id), 'role': str(role_id), 'amount': cost})
+        return True
+
+    # Shop
+
+    @property
+    def shop(self):
+        return self._data['shop']
+
+    def shop_items(self):
+        return {role: dict(item) for role, item in self.shop.items()}
+
+    def shop_cost(self, role_id: int):
+        item = self.shop.get(str(role_id))
+        return item['Cost'] if item else None
+
+    def add_shop_item(self, role_id: int, cost: int) -> bool:
+        if cost < 0:
+            raise ValueError('Cost must not be negative, got {}'.format(cost))
+        if str(role_id) in self.shop:
+            return False
+
+        self._record({'op': 'shop_add', 'role': str(role_id), 'cost': cost})
+        return True
+
+    def remove_shop_item(self, role_id: int) -> bool:
+        if str(role_id) not in self.shop:
+            return False
+
+        self._record({'op': 'shop_remove', 'role': str(role_id)})
+        return True
+
+    # Ledger
+
+    def _account(self, key: str):
+        return self._data.setdefault(key, {'Money': 0})
+
+    def _add_money(self, key: str, amount: int):
+        account = self._data.get(key)
+        old = account['Money'] if account is not None else None
+        if account is None:
+            account = self._account(key)
+        account['Money'] += amount
+
+        # Not built yet while the ledger is replayed on startup.
+        if self.leaderboard is not None:
+            self.leaderboard.update(int(key), old, account['Money'])
+
+    def _apply(self, entry: dict):
+        op = entry['op']
+        if op == 'credit':
+            self._add_money(entry['user'], entry['amount'])
+        elif op in ('debit', 'purchase'):
+            self._add_money(entry['user'], -entry['amount'])
+        elif op == 'transfer':
+            self._add_money(entry['from'], -entry['amount'])
+            self._add_money(entry['to'], entry['amount'])
+        elif op == 'shop_add':
+            self.shop[entry['role']] = {'Cost': entry['cost']}
+        elif op == 'shop_remove':
+            self.shop.pop(entry['role'], None)
+        else:
+            raise ValueError('Unknown ledger operation {!r}'.format(op))
+
+    def _record(self, entry: dict):
+        self._seq += 1
+        entry['seq'] = self._seq
+        entry['ts'] = int(time.time())
+
+        self._apply(entry)
+        # A single short line straight into the page cache; fsync happens
+        # in the background.
+        self._ledger.write(json.dumps(entry, separators=(',', ':')) + '\n')
+        self._ledger.flush()
+        self._pending += 1
+        self._unsynced = True
+
+    # Persistence
+
+    def _snapshot(self):
+        # Copy the nested dicts so the executor thread never iterates over
+        # something a command is mutating on the event loop.
+        snapshot = {key: dict(value) for key, value in self._data.items()}
+        snapshot['_seq'] = self._seq
+        return snapshot
+
+    def _write_snapshot(self, snapshot: dict):
+        write_json_atomic(self.path, snapshot)
+
+    def _remove_old_ledger(self):
+        try:
+            os.remove(self.ledger_path + '.old')
+        except FileNotFoundError:
+            pass
+
+    async def compact(self):
+        loop = asyncio.get_event_loop()
+
+        # Swap ledgers and copy the state in one go, without yielding, so
+        # every entry is either in the snapshot or in the new ledger.
+        snapshot = self._snapshot()
+        self._ledger.close()
+        os.replace(self.ledger_path, self.ledger_path + '.old')
+        self._ledger = open(self.ledger_path, 'a')
+        self._pending = 0
+        self._last_compaction = time.monotonic()
+
+        await loop.run_in_executor(None, self._write_snapshot, snapshot)
+        await loop.run_in_executor(None, self._remove_old_ledger)
+
+    async def _maintenance_loop(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            await asyncio.sleep(self.sync_interval)
+
+            try:
+                if self._unsynced:
+                    self._unsynced = False
+                    await loop.run_in_executor(None, os.fsync, self._ledger.fileno())
+
+                overdue = time.monotonic() - self._last_compaction >= self.compact_interval
+                if self._pending >= self.compact_threshold or (self._pending and overdue):
+                    await self.compact()
+            except Exception:
+                log.exception('Economy ledger maintenance failed')
+
+
+class _AcquireAll:
+    def __init__(self, locks):
+        self.locks = locks
+
+    async def __aenter__(self):
+        acquired = []
+        try:
+            for lock in self.locks:
+                await lock.acquire()
+                acquired.append(lock)
+        except BaseException:
+            for lock in reversed(acquired):
+                lock.release()
+            raise
+
+    async def __aexit__(self, *exc_info):
+        for lock in reversed(self.locks):
+            lock.release()
+
+
+class CooldownActive(commands.CheckFailure):
+    def __init__(self, retry_after: float):
+        super().__init__('Command is on cooldown, retry in {:.0f}s'.format(retry_after))
+        self.retry_after = retry_after
+
+
+class CooldownStore(JsonStore):
+    """Per-user cooldowns stored as expiry timestamps.
+
+    Checking or starting a cooldown is a dict lookup, nothing sleeps
+    while it runs. A heap ordered by expiry lets the background task drop
+    finished cooldowns without scanning the whole table, and the table
+    is written to ``path`` so cooldowns survive a restart.
+    """
+
+    SHARED_METHODS = ('remaining', 'claim', 'reset')
+
+    def __init__(self, path: str, *, flush_interval: float = 30):
+        super().__init__(path)
+        self.flush_interval = flush_interval
+
+        self._expiry = {}
+        self._heap = []
+
+        now = time.time()
+        for key, expires_at in self.load({}).items():
+            if expires_at > now:
+                self._expiry[key] = expires_at
+                self._heap.append((expires_at, key))
+        heapq.heapify(self._heap)
+
+    @staticmethod
+    def _key(bucket: str, user_id: int):
+        return '{}:{}'.format(bucket, user_id)
+
+    def remaining(self, bucket: str, user_id: int) -> float:
+        expires_at = self._expiry.get(self._key(bucket, user_id))
+        if expires_at is None:
+            return 0.0
+
+        return max(expires_at - time.time(), 0.0)
+
+    def claim(self, bucket: str, user_id: int, seconds: float) -> float:
+        """Starts the cooldown unless it is already running.
+
+        Returns 0 when the cooldown was started, otherwise the number of
+        seconds left on the running one.
+        """
+
+        retry_after = self.remaining(bucket, user_id)
+        if retry_after:
+            return retry_after
+
+        key = self._key(bucket, user_id)
+        expires_at = time.time() + seconds
+        self._expiry[key] = expires_at
+        heapq.heappush(self._heap, (expires_at, key))
+        self._dirty = True
+        return 0.0
+
+    def reset(self, bucket: str, user_id: int):
+        # The heap entry goes stale and is skipped once it comes up.
+        if self._expiry.pop(self._key(bucket, user_id), None) is not None:
+            self._dirty = True
+
+    def _purge(self):
+        now = time.time()
+        while self._heap and self._heap[0][0] <= now:
+            expires_at, key = heapq.heappop(self._heap)
+            if self._expiry.get(key) == expires_at:
+                del self._expiry[key]
+                self._dirty = True
+
+    def _data(self):
+        return dict(self._expiry)
+
+    async def close(self):
+        self._purge()
+        await super().close()
+
+    async def _flush(self):
+        self._purge()
+        await super()._flush()
+
+
+def persistent_cooldown(seconds: float, *, bucket: str = None):
+    """Check that lets a user run the command once every ``seconds``.
+
+    Unlike commands.cooldown the cooldown survives restarts. It starts as
+    soon as the check passes and raises CooldownActive while it runs.
+    """
+
+    async def predicate(ctx):
+        retry_after = await cooldowns.claim(bucket or ctx.command.qualified_name, ctx.author.id, seconds)
+        if retry_after:
+            raise CooldownActive(retry_after)
+        return True
+
+    return commands.check(predicate)
+
+
+class ActionScheduler(JsonStore):
+    """Runs delayed actions (unmute, unban, ...) from a single task.
+
+    Pending actions sit in a heap ordered by due time and are saved to
+    ``path``, so a restart picks them up again and anything that came
+    due while the bot was offline runs as soon as it is ready. An action
+    is identified by its kind and a key; scheduling the same pair again
+    replaces the old one.
+    """
+
+    def __init__(self, bot: commands.Bot, path: str):
+        super().__init__(path)
+        self.bot = bot
+
+        self._handlers = {}
+        self._actions = {}
+        self._heap = []
+        self._counter = itertools.count()
+
+        for action in self.load([]):
+            self._push(action)
+
+    def handler(self, kind: str):
+        def decorator(func):
+            self._handlers[kind] = func
+            return func
+        return decorator
+
+    def _push(self, action: dict):
+        ident = (action['kind'], action['key'])
+        self._actions[ident] = action
+        heapq.heappush(self._heap, (action['due'], next(self._counter), ident))
+
+    def schedule(self, kind: str, key: str, delay: float, **data):
+        action = dict(data, kind=kind, key=key, due=time.time() + delay)
+        self._push(action)
+        self._changed()
+        return action
+
+    def cancel(self, kind: str, key: str) -> bool:
+        if self._actions.pop((kind, key), None) is None:
+            return False
+
+        self._changed()
+        return True
+
+    def pending(self, kind: str = None):
+        return [action for action in self._actions.values() if kind is None or action['kind'] == kind]
+
+    def _data(self):
+        return list(self._actions.values())
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+
+        while True:
+            self._wakeup.clear()
+            await self._flush()
+
+            now = time.time()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, ident = heapq.heappop(self._heap)
+                action = self._actions.get(ident)
+                if action is not None and action['due'] == due:
+                    self.bot.loop.create_task(self._dispatch(ident, action))
+
+            delay = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _dispatch(self, ident, action: dict):
+        try:
+            await self._handlers[action['kind']](action)
+        except Exception:
+            log.exception('Scheduled %s for %s failed', *ident)
+        finally:
+            # Only forget it once it ran, so a crash mid-way retries it on
+            # the next start. It may also have been rescheduled meanwhile.
+            if self._actions.get(ident) is action:
+                del self._actions[ident]
+                self._changed()
+
+
+class PlayerStore(JsonStore):
+    """Saves every guild's player so a restart can pick up where it was.
+
+    Each connected player is kept as its voice and text channel, volume,
+    loop flag, the current song with how far into it playback got, and the
+    queue as ``[title, url, requester id]`` entries. The saved copy of a
+    guild is only rebuilt when its queue version, current song, volume or
+    loop flag changed; otherwise just the position is updated.
+
+    After a restart the players come back one guild every
+    ``restore_interval`` seconds, and only where someone is still in the
+    voice channel. Restored songs are resolved like playlist entries, when
+    they come up, so nothing is extracted up front.
+    """
+
+    def __init__(self, bot: commands.Bot, path: str, *, flush_interval: float = 10, restore_interval: float = 2):
+        super().__init__(path)
+        self.bot = bot
+        self.flush_interval = flush_interval
+        self.restore_interval = restore_interval
+
+        self._snapshots = {}
+        self._fingerprints = {}
+        self._pending = self.load({})
+
+    @staticmethod
+    def _fingerprint(state: VoiceState):
+        return (state.songs.version, id(state.current), state.volume, state.loop, state.voice.channel.id)
+
+    @staticmethod
+    def _snapshot(state: VoiceState):
+        current = state.current
+        channel = current.channel if current is not None else state._ctx.channel if state._ctx else None
+
+        return {
+            'voice_channel': state.voice.channel.id,
+            'text_channel': channel.id if channel is not None else None,
+            'volume': state.volume,
+            'loop': state.loop,
+            'current': [current.track.title, current.track.url, current.requester.id] if current else None,
+            'position': 0.0,
+            'queue': [[song.track.title, song.track.url, song.requester.id] for song in state.songs],
+        }
+
+    def _update(self) -> bool:
+        """Brings the saved copies up to date, returns whether anything changed."""
+
+        music = self.bot.get_cog('Music')
+        states = {str(guild_id): state for guild_id, state in music.voice_states.items()
+                  if state.voice is not None and state.voice.is_connected()} if music else {}
+
+        changed = False
+        for guild_id in list(self._snapshots):
+            if guild_id not in states:
+                del self._snapshots[guild_id]
+                del self._fingerprints[guild_id]
+                changed = True
+
+        for guild_id, state in states.items():
+            fingerprint = self._fingerprint(state)
+            if self._fingerprints.get(guild_id) != fingerprint:
+                self._snapshots[guild_id] = self._snapshot(state)
+                self._fingerprints[guild_id] = fingerprint
+                changed = True
+
+            source = state.current.source if state.current is not None else None
+            position = round(source.elapsed, 1) if source is not None else 0.0
+            if self._snapshots[guild_id]['position'] != position:
+                self._snapshots[guild_id]['position'] = position
+                changed = True
+
+        return changed
+
+    def _data(self):
+        # Guilds still waiting to be restored keep their old entry.
+        return dict(self._pending, **self._snapshots)
+
+    async def close(self):
+        if self._update():
+            self._dirty = True
+        await super().close()
+
+    async def _flush(self):
+        if self._update():
+            self._dirty = True
+        await super()._flush()
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        flusher = self.bot.loop.create_task(super()._run())
+        try:
+            for guild_id in list(self._pending):
+                snapshot = self._pending.pop(guild_id)
+                # A guild that isn't restored is dropped from the file too.
+                self._dirty = True
+                try:
+                    restored = await self._restore(int(guild_id), snapshot)
+                except Exception:
+                    log.exception('Failed to restore the player in guild %s', guild_id)
+                    continue
+
+                if restored:
+                    await asyncio.sleep(self.restore_interval)
+            await flusher
+        finally:
+            flusher.cancel()
+
+    async def _restore(self, guild_id: int, snapshot: dict) -> bool:
+        music = self.bot.get_cog('Music')
+        guild = self.bot.get_guild(guild_id)
+        if music is None or guild is None or guild_id in music.voice_states:
+            return False
+
+        voice_channel = guild.get_channel(snapshot['voice_channel'])
+        text_channel = guild.get_channel(snapshot['text_channel']) if snapshot['text_channel'] else None
+        if voice_channel is None or text_channel is None or not any(not m.bot for m in voice_channel.members):
+            return False
+
+        def song(entry, start=0.0):
+            title, url, requester_id = entry
+            return Song(Track(title, url), guild.get_member(requester_id) or guild.me, text_channel, start=start)
+
+        state = VoiceState(self.bot, None)
+        music.voice_states[guild_id] = state
+        try:
+            state.voice = await voice_channel.connect()
+        except (asyncio.TimeoutError, discord.ClientException):
+            music.voice_states.pop(guild_id, None)
+            raise
+
+        state.volume = snapshot['volume']
+        state.loop = snapshot['loop']
+        if snapshot['current'] is not None:
+            state.songs.put_nowait(song(snapshot['current'], start=snapshot['position']))
+        for entry in snapshot['queue']:
+            state.songs.put_nowait(song(entry))
+        state.start()
+
+        log.info('Restored the player in guild %s with %d songs', guild_id, len(state.songs))
+        await text_channel.send('Бот перезапустился, продолжаю играть очередь ({} треков)'.format(len(state.songs)))
+        return True
+
+
+class GuildSettings(JsonStore):
+    """Per-guild role, channel and user ids, kept in memory.
+
+    Loaded once from ``path`` and resolved through ``guild.get_role`` and
+    ``guild.get_channel``, so commands never scan lists or touch the disk.
+    ``!setconfig`` changes a value and the file is rewritten in the
+    background; ``!reloadconfig`` picks up edits made to the file by hand.
+    ``default`` seeds the file the first time the bot runs.
+    """
+
+    KEYS = {
+        'log_channel': 'канал для логов модерации и приветствий',
+        'mute_role': 'роль мута',
+        'join_role': 'роль, которую получают новые участники',
+        'temp_lobby': 'голосовой канал, который создаёт личные каналы',
+        'temp_category': 'категория для личных каналов',
+        'moderator': 'пользователь, от имени которого снимается мут по времени',
+    }
+
+    def __init__(self, bot: commands.Bot, path: str, *, default: dict = None):
+        super().__init__(path)
+        self.bot = bot
+
+        self._settings = self._parse(self.load(default or {}))
+
+    def _load(self):
+        return self._parse(self._read())
+
+    @staticmethod
+    def _parse(data: dict):
+        return {int(guild_id): {key: int(value) for key, value in settings.items()}
+                for guild_id, settings in data.items()}
+
+    async def reload(self):
+        self._settings = await self.bot.loop.run_in_executor(None, self._load)
+
+    def get(self, guild_id: int, key: str):
+        return self._settings.get(guild_id, {}).get(key)
+
+    def all(self, guild_id: int):
+        return dict(self._settings.get(guild_id, {}))
+
+    def set(self, guild_id: int, key: str, value: int = None):
+        if key not in self.KEYS:
+            raise KeyError(key)
+
+        settings = self._settings.setdefault(guild_id, {})
+        if value is None:
+            settings.pop(key, None)
+        else:
+            settings[key] = value
+        self._changed()
+
+    def role(self, guild: discord.Guild, key: str):
+        role_id = self.get(guild.id, key)
+        return guild.get_role(role_id) if role_id is not None else None
+
+    def channel(self, guild: discord.Guild, key: str):
+        channel_id = self.get(guild.id, key)
+        return guild.get_channel(channel_id) if channel_id is not None else None
+
+    def _data(self):
+        return {str(guild_id): dict(settings) for guild_id, settings in self._settings.items()}
+
+
+class TempChannelManager(JsonStore):
+    """Gives everyone who joins the lobby channel a voice channel of their own.
+
+    Owned channels are indexed by id, so each voice event is handled with a
+    couple of dict lookups. A channel that empties is deleted after
+    ``delete_delay`` seconds unless somebody comes back in the meantime.
+    The index is saved to ``path``; once the bot is ready, channels left
+    over from before a restart are picked up again or deleted if empty.
+    """
+
+    NAME_PREFIX = 'канал '
+
+    def __init__(self, bot: commands.Bot, path: str, *, settings: GuildSettings, delete_delay: float = 10):
+        super().__init__(path)
+        self.bot = bot
+        self.settings = settings
+        self.delete_delay = delete_delay
+
+        self._owners = {}
+        self._deletions = {}
+        self._channels = {int(channel_id): entry for channel_id, entry in self.load({}).items()}
+
+        for channel_id, entry in self._channels.items():
+            self._owners[(entry['guild'], entry['owner'])] = channel_id
+
+    def owned(self, channel_id: int) -> bool:
+        return channel_id in self._channels
+
+    async def on_voice_state_update(self, member: discord.Member, before: discord.VoiceState,
+                                    after: discord.VoiceState):
+        if before.channel == after.channel:
+            return
+
+        if after.channel is not None:
+            if after.channel.id == self.settings.get(member.guild.id, 'temp_lobby'):
+                await self._give_channel(member)
+            elif after.channel.id in self._channels:
+                self._cancel_deletion(after.channel.id)
+
+        if before.channel is not None and before.channel.id in self._channels and not before.channel.members:
+            self._schedule_deletion(before.channel)
+
+    async def _give_channel(self, member: discord.Member):
+        guild = member.guild
+        channel = guild.get_channel(self._owners.get((guild.id, member.id), 0))
+        if channel is None:
+            category = self.settings.channel(guild, 'temp_category')
+            overwrites = {member: discord.PermissionOverwrite(connect=True, mute_members=True, move_members=True,
+                                                              manage_channels=True)}
+            channel = await guild.create_voice_channel(name=self.NAME_PREFIX + member.display_name,
+                                                       category=category, overwrites=overwrites)
+            self._add(channel, member)
+
+        self._cancel_deletion(channel.id)
+        try:
+            await member.move_to(channel)
+        except discord.HTTPException:
+            # They left the lobby before the channel was ready.
+            pass
+
+        if not channel.members:
+            self._schedule_deletion(channel)
+
+    def _add(self, channel: discord.VoiceChannel, owner: discord.Member):
+        self._channels[channel.id] = {'guild': channel.guild.id, 'owner': owner.id}
+        self._owners[(channel.guild.id, owner.id)] = channel.id
+        self._changed()
+
+    def _forget(self, channel_id: int):
+        entry = self._channels.pop(channel_id, None)
+        if entry is not None:
+            self._owners.pop((entry['guild'], entry['owner']), None)
+            self._changed()
+        self._cancel_deletion(channel_id)
+
+    def _schedule_deletion(self, channel: discord.VoiceChannel):
+        if channel.id not in self._deletions:
+            self._deletions[channel.id] = self.bot.loop.create_task(self._delete_later(channel))
+
+    def _cancel_deletion(self, channel_id: int):
+        task = self._deletions.pop(channel_id, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+
+    async def _delete_later(self, channel: discord.VoiceChannel):
+        await asyncio.sleep(self.delete_delay)
+        if channel.members:
+            self._deletions.pop(channel.id, None)
+            return
+
+        self._forget(channel.id)
+        try:
+            await channel.delete()
+        except discord.NotFound:
+            pass
+        except discord.HTTPException:
+            log.exception('Failed to delete temporary channel %s', channel.id)
+
+    async def _reconcile(self):
+        """Deals with channels created before the restart, including ones the index never saw."""
+
+        for channel_id in list(self._channels):
+            channel = self.bot.get_channel(channel_id)
+            if channel is None:
+                self._forget(channel_id)
+            elif not channel.members:
+                self._schedule_deletion(channel)
+
+        for guild in self.bot.guilds:
+            category = self.settings.channel(guild, 'temp_category')
+            if not isinstance(category, discord.CategoryChannel):
+                continue
+            for channel in category.voice_channels:
+                if (channel.id not in self._channels and channel.id != self.settings.get(guild.id, 'temp_lobby')
+                        and channel.name.startswith(self.NAME_PREFIX) and not channel.members):
+                    log.info('Deleting orphaned temporary channel %s', channel.id)
+                    self._channels[channel.id] = {'guild': guild.id, 'owner': None}
+                    self._schedule_deletion(channel)
+
+    def _data(self):
+        return dict(self._channels)
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        await self._reconcile()
+        await super()._run()
+
+
+class ReactionRoles(JsonStore):
+    """Hands out roles for reactions on chosen messages.
+
+    Bindings live in ``path`` and are indexed by ``(message id, emoji)``,
+    so a reaction on any other message is dismissed with one dict lookup.
+    Roles and members come from the gateway cache. A member it doesn't
+    hold, such as one removing a reaction under the lazy member cache, is
+    fetched. ``default`` seeds the file the first time the bot runs.
+    """
+
+    def __init__(self, bot: commands.Bot, path: str, *, default=()):
+        super().__init__(path)
+        self.bot = bot
+
+        self._bindings = {}
+        for binding in self.load(list(default)):
+            self._bindings[(binding['message'], binding['emoji'])] = binding
+
+    def bind(self, guild_id: int, message_id: int, emoji: str, role_id: int):
+        self._bindings[(message_id, emoji)] = {'guild': guild_id, 'message': message_id, 'emoji': emoji,
+                                               'role': role_id}
+        self._changed()
+
+    def unbind(self, message_id: int, emoji: str) -> bool:
+        if self._bindings.pop((message_id, emoji), None) is None:
+            return False
+
+        self._changed()
+        return True
+
+    def bindings(self, guild_id: int):
+        return [binding for binding in self._bindings.values() if binding['guild'] == guild_id]
+
+    async def _resolve(self, payload: discord.RawReactionActionEvent):
+        binding = self._bindings.get((payload.message_id, str(payload.emoji)))
+        if binding is None or payload.guild_id != binding['guild']:
+            return None, None
+
+        guild = self.bot.get_guild(payload.guild_id)
+        if guild is None:
+            return None, None
+
+        # Removals never carry the member.
+        member = payload.member or await self.bot.get_or_fetch_member(guild, payload.user_id)
+        if member is None or member.bot:
+            return None, None
+
+        return member, guild.get_role(binding['role'])
+
+    async def on_reaction_add(self, payload: discord.RawReactionActionEvent):
+        member, role = await self._resolve(payload)
+        if role is not None and role not in member.roles:
+            await member.add_roles(role, reason='Reaction role')
+
+    async def on_reaction_remove(self, payload: discord.RawReactionActionEvent):
+        member, role = await self._resolve(payload)
+        if role is not None and role in member.roles:
+            await member.remove_roles(role, reason='Reaction role')
+
+    def _data(self):
+        return list(self._bindings.values())
+
+
+def make_intents(profile: str) -> discord.Intents:
+    """Gateway intents for a startup profile.
+
+    ``all`` asks for everything, presences included. ``features`` only
+    asks for what the bot's commands and events use: guilds, members for
+    on_member_join and member arguments, voice states for music and the
+    temporary channels, messages for commands and reactions for reaction
+    roles and the queue pages.
+    """
+
+    if profile == 'all':
+        return discord.Intents.all()
+    if profile != 'features':
+        raise ValueError('Unknown intents profile {!r}'.format(profile))
+
+    return discord.Intents(guilds=True, members=True, voice_states=True, guild_messages=True, dm_messages=True,
+                           guild_reactions=True)
+
+
+def make_member_cache(policy: str, intents: discord.Intents):
+    """Member cache flags and whether to chunk every guild at startup.
+
+    ``full`` caches and chunks everyone up front. ``lazy`` keeps members
+    who are in voice or joined since startup, and each guild is chunked
+    the first time someone uses a command there. ``voice`` never chunks.
+    """
+
+    if policy == 'full':
+        return discord.MemberCacheFlags.from_intents(intents), True
+    if policy == 'lazy':
+        return discord.MemberCacheFlags(voice=True, joined=intents.members, online=False), False
+    if policy == 'voice':
+        return discord.MemberCacheFlags(voice=True, joined=False, online=False), False
+    raise ValueError('Unknown member cache policy {!r}'.format(policy))
+
+
+class ImageError(Exception):
+    pass
+
+
+class NekosLifeProvider:
+    """Image URLs from the nekos.life API, over one pooled aiohttp session."""
+
+    BASE_URL = 'https://nekos.life/api/v2/img/'
+
+    def __init__(self, *, timeout: float = 5, connections: int = 8):
+        self.timeout = timeout
+        self.connections = connections
+        self._session = None
+
+    def _get_session(self):
+        # Created on first use so it belongs to the running loop.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.connections),
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def fetch(self, category: str) -> str:
+        endpoint = 'Random_hentai_gif' if category == 'random_hentai_gif' else category
+        try:
+            async with self._get_session().get(self.BASE_URL + endpoint) as response:
+                response.raise_for_status()
+                data = await response.json(content_type=None)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+            raise ImageError('nekos.life: {}'.format(e) if str(e) else 'nekos.life timed out')
+
+        if not data.get('url'):
+            raise ImageError('nekos.life has nothing for {!r}'.format(category))
+        return data['url']
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+class StubProvider:
+    """Made-up image URLs, for running the bot without network access."""
+
+    def __init__(self):
+        self._counter = itertools.count()
+
+    async def fetch(self, category: str) -> str:
+        return 'https://example.com/{}/{}.png'.format(category, next(self._counter))
+
+    async def close(self):
+        pass
+
+
+class ImageBuffer:
+    """Keeps a few image URLs per category ready to send.
+
+    Commands take a URL from memory and a background task tops the
+    category back up to ``size``. A category is only buffered once it was
+    asked for, or from the start if it is in ``prefetch``. An empty buffer
+    falls back to asking the provider directly.
+    """
+
+    def __init__(self, provider, categories, *, size: int = 5, prefetch=()):
+        self.provider = provider
+        self.categories = frozenset(categories)
+        self.size = size
+        self.prefetch = prefetch
+
+        self.hits = 0
+        self.misses = 0
+        self._buffers = collections.defaultdict(collections.deque)
+        self._refills = {}
+
+    async def get(self, category: str) -> str:
+        if category not in self.categories:
+            raise ImageError('Unknown image category {!r}'.format(category))
+
+        buffer = self._buffers[category]
+        if buffer:
+            self.hits += 1
+            url = buffer.popleft()
+        else:
+            self.misses += 1
+            url = await self.provider.fetch(category)
+
+        self._refill(category)
+        return url
+
+    def _refill(self, category: str):
+        task = self._refills.get(category)
+        if (task is None or task.done()) and len(self._buffers[category]) < self.size:
+            self._refills[category] = asyncio.get_event_loop().create_task(self._fill(category))
+
+    async def _fill(self, category: str):
+        buffer = self._buffers[category]
+        while len(buffer) < self.size:
+            try:
+                buffer.append(await self.provider.fetch(category))
+            except ImageError as e:
+                log.warning('Could not buffer %s images: %s', category, e)
+                return
+
+    def stats(self):
+        return {'hits': self.hits, 'misses': self.misses,
+                'buffered': {category: len(buffer) for category, buffer in self._buffers.items() if buffer}}
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        for category in self.prefetch:
+            self._refills[category] = loop.create_task(self._fill(category))
+
+    async def close(self):
+        for task in self._refills.values():
+            task.cancel()
+        self._refills = {}
+        await self.provider.close()
+
+
+class CountingThreadPool(concurrent.futures.ThreadPoolExecutor):
+    """The loop's default executor, counting jobs that wait and jobs that run."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queued = 0
+        self.running = 0
+        self._count_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._count_lock:
+            self.queued += 1
+        try:
+            return super().submit(self._run, fn, *args, **kwargs)
+        except BaseException:
+            with self._count_lock:
+                self.queued -= 1
+            raise
+
+    def _run(self, fn, *args, **kwargs):
+        with self._count_lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._count_lock:
+                self.running -= 1
+
+
+class Metrics:
+    """Command latencies, event loop lag and gauges on a Prometheus endpoint.
+
+    Command timings come from the on_command, on_command_completion and
+    on_command_error events. A task measures how late a short sleep wakes
+    up to see how far the loop lags behind. Gauges are functions
+    registered with ``gauge()`` and only run when ``/metrics`` is scraped.
+    The endpoint listens on ``address`` (host:port); None turns it off.
+    """
+
+    LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+    def __init__(self, bot: commands.Bot, address: str = None, *, lag_interval: float = 0.5,
+                 executor_workers: int = None):
+        self.bot = bot
+        self.address = address
+        self.lag_interval = lag_interval
+
+        self.commands = collections.defaultdict(Histogram)
+        self.loop_lag = Histogram(self.LAG_BUCKETS)
+        self.max_lag = 0.0
+        self.executor = CountingThreadPool(executor_workers, thread_name_prefix='executor')
+        self._gauges = {}
+        self._task = None
+        self._runner = None
+
+    def gauge(self, name: str, help: str):
+        """Registers a function returning a number, or a dict of ``{labels: number}``."""
+
+        def decorator(func):
+            self._gauges[name] = (help, func)
+            return func
+        return decorator
+
+    async def on_command(self, ctx: commands.Context):
+        ctx.metrics_started = time.perf_counter()
+
+    async def on_command_completion(self, ctx: commands.Context):
+        self._observe(ctx, 'ok')
+
+    async def on_command_error(self, ctx: commands.Context, error: commands.CommandError):
+        self._observe(ctx, 'error')
+
+        # Any on_command_error listener turns off discord.py's default
+        # handler, so errors nobody handles are reported here instead.
+        if ctx.command is not None and (ctx.command.has_error_handler()
+                                        or (ctx.cog is not None and ctx.cog.has_error_handler())):
+            return
+        log.error('Ignoring exception in command %s', ctx.command, exc_info=(type(error), error, error.__traceback__))
+
+    def _observe(self, ctx: commands.Context, status: str):
+        started = getattr(ctx, 'metrics_started', None)
+        if started is not None and ctx.command is not None:
+            self.commands[(ctx.command.qualified_name, status)].observe(time.perf_counter() - started)
+
+    async def _watch_lag(self):
+        while True:
+            expected = time.perf_counter() + self.lag_interval
+            await asyncio.sleep(self.lag_interval)
+            lag = max(time.perf_counter() - expected, 0.0)
+            self.loop_lag.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    @staticmethod
+    def _labels(labels: dict):
+        if not labels:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for key, value in labels.items()) + '}'
+
+    def _histogram(self, lines: list, name: str, histogram: Histogram, labels: dict = None):
+        labels = labels or {}
+        for bound, count in histogram.cumulative():
+            lines.append('{}_bucket{} {}'.format(name, self._labels(dict(labels, le=bound)), count))
+        lines.append('{}_bucket{} {}'.format(name, self._labels(dict(labels, le='+Inf')), histogram.count))
+        lines.append('{}_sum{} {}'.format(name, self._labels(labels), histogram.sum))
+        lines.append('{}_count{} {}'.format(name, self._labels(labels), histogram.count))
+
+    def render(self) -> str:
+        lines = ['# HELP racingbot_command_seconds Time from invoking a command to its completion or error.',
+                 '# TYPE racingbot_command_seconds histogram']
+        for (command, status), histogram in sorted(self.commands.items()):
+            self._histogram(lines, 'racingbot_command_seconds', histogram, {'command': command, 'status': status})
+
+        lines += ['# HELP racingbot_extraction_seconds Time youtube-dl jobs spend in the extraction pool.',
+                  '# TYPE racingbot_extraction_seconds histogram']
+        for kind, histogram in sorted(YTDLSource.engine.job_seconds.items()):
+            self._histogram(lines, 'racingbot_extraction_seconds', histogram, {'kind': kind})
+
+        lines += ['# HELP racingbot_loop_lag_seconds How late the event loop ran a timer.',
+                  '# TYPE racingbot_loop_lag_seconds histogram']
+        self._histogram(lines, 'racingbot_loop_lag_seconds', self.loop_lag)
+        lines += ['# HELP racingbot_loop_lag_max_seconds Worst event loop lag since the last scrape.',
+                  '# TYPE racingbot_loop_lag_max_seconds gauge',
+                  'racingbot_loop_lag_max_seconds {}'.format(self.max_lag)]
+        self.max_lag = 0.0
+
+        for name, (help, func) in sorted(self._gauges.items()):
+            try:
+                value = func()
+            except Exception:
+                log.exception('Gauge %s failed', name)
+                continue
+
+            lines += ['# HELP {} {}'.format(name, help), '# TYPE {} gauge'.format(name)]
+            if isinstance(value, dict):
+                for labels, number in value.items():
+                    lines.append('{}{} {}'.format(name, self._labels(dict(labels)), number))
+            else:
+                lines.append('{} {}'.format(name, value))
+
+        return '\n'.join(lines) + '\n'
+
+    async def _serve_metrics(self, request):
+        return web.Response(text=self.render(), content_type='text/plain', charset='utf-8',
+                            headers={'X-Content-Type-Options': 'nosniff'})
+
+    async def _serve(self):
+        app = web.Application()
+        app.router.add_get('/metrics', self._serve_metrics)
+        self._runner = web.AppRunner(app)
+        await self._runner.setup()
+
+        host, port = self.address.rsplit(':', 1)
+        await web.TCPSite(self._runner, host, int(port)).start()
+        log.info('Serving metrics on http://%s/metrics', self.address)
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if self._task is not None:
+            return
+
+        loop.set_default_executor(self.executor)
+        self.bot.add_listener(self.on_command)
+        self.bot.add_listener(self.on_command_completion)
+        self.bot.add_listener(self.on_command_error)
+        self._task = loop.create_task(self._watch_lag())
+        if self.address:
+            loop.create_task(self._serve())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+        self.executor.shutdown(wait=False)
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return '{} ({}:{})'.format(code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+
+class LoopWatchdog:
+    """Catches whatever keeps the event loop from running other callbacks.
+
+    A thread asks the loop to run a no-op callback every ``interval``
+    seconds. When the loop hasn't got to it after ``threshold`` seconds,
+    the thread takes the stack the loop thread is in at that moment, so
+    it points at the blocking code itself and not at whoever scheduled
+    it, and then waits for the loop to come back to measure the stall.
+    The last ``keep`` stalls are kept and each one is logged.
+    """
+
+    def __init__(self, threshold: float = 0.1, *, interval: float = 0.05, keep: int = 50):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls = collections.deque(maxlen=keep)
+        self.total = 0
+
+        self._loop = None
+        self._loop_thread = None
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if self._thread is not None or not self.threshold:
+            return
+
+        self._loop = loop
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        # Only once the loop runs; until then it is still busy starting up.
+        loop.call_soon(self._start_thread)
+
+    def _start_thread(self):
+        self._loop_thread = threading.get_ident()
+        self._thread.start()
+
+    async def close(self):
+        self._stopped.set()
+
+    def _watch(self):
+        while not self._stopped.is_set():
+            answered = threading.Event()
+            started = time.perf_counter()
+            try:
+                self._loop.call_soon_threadsafe(answered.set)
+            except RuntimeError:
+                # The loop is closed.
+                return
+
+            if not answered.wait(self.threshold):
+                frame = sys._current_frames().get(self._loop_thread)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+                del frame
+                while not answered.wait(self.interval):
+                    if self._stopped.is_set():
+                        return
+                self._record(time.perf_counter() - started, stack)
+
+            self._stopped.wait(self.interval)
+
+    def _record(self, seconds: float, stack: str):
+        self.total += 1
+        self.stalls.append({'at': time.time(), 'seconds': seconds, 'stack': stack})
+        log.warning('Event loop was blocked for %.0f ms in:\n%s', seconds * 1000, stack)
+
+    def report(self, count: int = None) -> str:
+        stalls = list(self.stalls)[-count:] if count else list(self.stalls)
+        return '\n'.join('{} blocked for {:.0f} ms\n{}'.format(
+            datetime.datetime.fromtimestamp(stall['at']).isoformat(timespec='seconds'), stall['seconds'] * 1000,
+            stall['stack']) for stall in stalls)
+
+
+class SamplingProfiler:
+    """Samples thread stacks on a timer, for looking at a live process.
+
+    Every ``interval`` seconds ``sys._current_frames()`` gives the stack
+    of each thread, which is counted under its collapsed form, one
+    ``thread;outer;...;inner`` line per stack. That is the input
+    flamegraph.pl and speedscope take. Nothing runs in the sampled
+    threads themselves, so the cost is this thread waking up.
+    """
+
+    def __init__(self, *, interval: float = 0.005, threads=None):
+        self.interval = interval
+        # Thread idents to sample; None samples all of them.
+        self.threads = threads
+        self.samples = 0
+        self.stacks = collections.Counter()
+
+    def run(self, seconds: float):
+        me = threading.get_ident()
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me or (self.threads is not None and ident not in self.threads):
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+            self.samples += 1
+            time.sleep(self.interval)
+        return self
+
+    def collapsed(self) -> str:
+        return ''.join('{} {}\n'.format(stack, count) for stack, count in self.stacks.most_common())
+
+    def top(self, count: int = 5):
+        """The functions most often on top of a stack, with their share of the samples."""
+
+        leaves = collections.Counter()
+        for stack, samples in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += samples
+        total = sum(leaves.values()) or 1
+        return [(name, samples / total) for name, samples in leaves.most_common(count)]
+
+
+class ClusterLink:
+    """Lets this process ask the other clusters things.
+
+    When cluster.py started the process, it connects to the launcher at
+    ``address`` and exchanges JSON messages with the other clusters
+    through it. ``request`` runs a handler in one cluster, ``broadcast``
+    in all of them. Started as plain ``python bot.py`` there is only this
+    process and both just call the local handler.
+    """
+
+    def __init__(self, bot: commands.Bot, address: str = None, *, cluster_id: int = 0, cluster_count: int = 1,
+                 shard_count: int = 1, timeout: float = 5):
+        self.bot = bot
+        self.address = address
+        self.cluster_id = cluster_id
+        self.cluster_count = cluster_count
+        self.shard_count = shard_count
+        self.timeout = timeout
+
+        self._handlers = {}
+        self._pending = {}
+        self._ids = itertools.count()
+        self._writer = None
+        self._connected = asyncio.Event()
+        self._task = None
+
+    @property
+    def enabled(self):
+        return self.address is not None
+
+    def handler(self, method: str):
+        def decorator(func):
+            self._handlers[method] = func
+            return func
+        return decorator
+
+    def cluster_of(self, guild_id: int) -> int:
+        return cluster.cluster_of(guild_id, self.cluster_count, self.shard_count)
+
+    async def request(self, cluster_id: int, method: str, **args):
+        if not self.enabled or cluster_id == self.cluster_id:
+            return await self._handlers[method](**args)
+        return await self._send(cluster_id, method, args)
+
+    async def broadcast(self, method: str, **args):
+        if not self.enabled:
+            return [await self._handlers[method](**args)]
+        return await self._send('all', method, args)
+
+    async def _send(self, to, method: str, args: dict):
+        await asyncio.wait_for(self._connected.wait(), self.timeout)
+
+        request_id = next(self._ids)
+        future = self._pending[request_id] = self.bot.loop.create_future()
+        cluster.write_message(self._writer, {'op': 'request', 'id': request_id, 'to': to, 'method': method,
+                                             'args': args})
+        try:
+            message = await asyncio.wait_for(future, self.timeout)
+        finally:
+            self._pending.pop(request_id, None)
+
+        if 'error' in message:
+            raise RuntimeError(message['error'])
+        return message['result']
+
+    async def _answer(self, message: dict):
+        try:
+            result = await self._handlers[message['method']](**message['args'])
+        except Exception as e:
+            log.exception('Cluster request %s failed', message['method'])
+            reply = {'op': 'response', 'id': message['id'], 'error': '{}: {}'.format(type(e).__name__, e)}
+        else:
+            reply = {'op': 'response', 'id': message['id'], 'result': result}
+
+        if self._writer is not None:
+            cluster.write_message(self._writer, reply)
+
+    def start(self, loop: asyncio.AbstractEventLoop):
+        if self.enabled and self._task is None:
+            self._task = loop.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    async def _run(self):
+        host, port = self.address.rsplit(':', 1)
+        while True:
+            try:
+                reader, self._writer = await asyncio.open_connection(host, int(port))
+                cluster.write_message(self._writer, {'op': 'hello', 'cluster': self.cluster_id})
+                self._connected.set()
+
+                while True:
+                    message = await cluster.read_message(reader)
+                    if message['op'] == 'request':
+                        self.bot.loop.create_task(self._answer(message))
+                    elif message['op'] == 'response' and message['id'] in self._pending:
+                        self._pending[message['id']].set_result(message)
+            except (OSError, asyncio.IncompleteReadError) as e:
+                log.warning('Lost the cluster link: %s', e)
+            finally:
+                self._connected.clear()
+                self._writer = None
+
+            await asyncio.sleep(1)
+
+
+class SharedStore:
+    """A store that lives in one cluster, usable from all of them.
+
+    The owning cluster passes the store itself and the calls go straight
+    to it; everywhere else they are sent over the cluster link. Either
+    way every method in ``methods`` becomes a coroutine. Per-user data
+    such as wallets and cooldowns is not tied to any guild, so it can't
+    be split by shard like the rest.
+    """
+
+    def __init__(self, link: ClusterLink, name: str, methods, store=None, *, owner: int = 0):
+        self.link = link
+        self.name = name
+        self.methods = frozenset(methods)
+        self.store = store
+        self.owner = owner
+        self._locks = weakref.WeakValueDictionary()
+
+        if store is not None:
+            link.handler(name)(self._call_local)
+
+    async def _call_local(self, call: str, args: list):
+        if call not in self.methods:
+            raise AttributeError(call)
+
+        result = getattr(self.store, call)(*args)
+        if asyncio.iscoroutine(result):
+            result = await result
+        return result
+
+    async def call(self, method: str, *args):
+        if self.store is not None:
+            return await self._call_local(method, list(args))
+        return await self.link.request(self.owner, self.name, call=method, args=list(args))
+
+    def __getattr__(self, method: str):
+        if method.startswith('_') or method not in self.methods:
+            raise AttributeError(method)
+        return functools.partial(self.call, method)
+
+    def lock(self, *keys):
+        """Serializes commands of this process on the given keys, see EconomyStore.lock."""
+
+        locks = []
+        for key in sorted(set(keys)):
+            lock = self._locks.get(key)
+            if lock is None:
+                lock = self._locks[key] = asyncio.Lock()
+            locks.append(lock)
+
+        return _AcquireAll(locks)
+
+
+def data_path(name: str) -> str:
+    """Where a store that only holds this cluster's guilds keeps its file.
+
+    Each cluster gets a directory of its own. The first time a cluster
+    runs, it starts from the file a single-process bot left behind; the
+    guilds in it that belong to other clusters are never looked up.
+    """
+
+    if CLUSTER_ID is None:
+        return name
+
+    path = os.path.join('cluster-{}'.format(CLUSTER_ID), name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if not os.path.exists(path) and os.path.isfile(name):
+        shutil.copyfile(name, path)
+    return path
+
+
+class RacingBot(commands.AutoShardedBot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Anything with an async close() that has to persist state before exit.
+        self.stores = []
+
+        self.lazy_chunking = self.intents.members and not kwargs.get('chunk_guilds_at_startup', self.intents.members)
+        self._chunking = {}
+        self._started_at = time.monotonic()
+        self._startup_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        self.startup_report = None
+
+        self.before_invoke(self._chunk_before_invoke)
+
+    async def _chunk_before_invoke(self, ctx: commands.Context):
+        if self.lazy_chunking and ctx.guild is not None:
+            await self.ensure_chunked(ctx.guild)
+
+    async def ensure_chunked(self, guild: discord.Guild):
+        """Loads the guild's member list once, the first time it is needed."""
+
+        if guild.chunked:
+            return
+
+        task = self._chunking.get(guild.id)
+        if task is None:
+            task = self._chunking[guild.id] = self.loop.create_task(guild.chunk(cache=True))
+            task.add_done_callback(lambda _: self._chunking.pop(guild.id, None))
+        await asyncio.shield(task)
+
+    async def get_or_fetch_member(self, guild: discord.Guild, user_id: int):
+        """Returns the member from the cache, or from the API if the cache doesn't hold them.
+
+        With the lazy member cache most members are missing until their
+        guild is chunked. None means they are no longer in the guild.
+        """
+
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+
+        try:
+            return await guild.fetch_member(user_id)
+        except discord.NotFound:
+            return None
+
+    def report_startup(self):
+        """Records how long it took to get ready and how much memory the caches took."""
+
+        if self.startup_report is None:
+            self.startup_report = {
+                'seconds': round(time.monotonic() - self._started_at, 2),
+                'rss_growth_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - self._startup_rss,
+                'guilds': len(self.guilds),
+                'chunked_guilds': sum(1 for guild in self.guilds if guild.chunked),
+                'cached_members': sum(len(guild.members) for guild in self.guilds),
+                'intents': [name for name, enabled in self.intents if enabled],
+            }
+            log.info('Startup: %s', self.startup_report)
+        return self.startup_report
+
+    def add_store(self, store):
+        self.stores.append(store)
+        store.start(self.loop)
+        return store
+
+    async def close(self):
+        for store in reversed(self.stores):
+            try:
+                await store.close()
+            except Exception:
+                log.exception('Failed to close %r', store)
+
+        await super().close()
+
+
+# Set by cluster.py; a plain `python bot.py` runs every shard itself.
+CLUSTER_ID = int(os.environ['CLUSTER_ID']) if 'CLUSTER_ID' in os.environ else None
+SHARD_COUNT = int(os.environ['SHARD_COUNT']) if 'SHARD_COUNT' in os.environ else None
+SHARD_IDS = [int(shard) for shard in os.environ['SHARD_IDS'].split(',')] if 'SHARD_IDS' in os.environ else None
+
+intents = make_intents(os.environ.get('INTENTS_PROFILE', 'features'))
+member_cache_flags, chunk_guilds_at_startup = make_member_cache(os.environ.get('MEMBER_CACHE', 'lazy'), intents)
+bot = RacingBot('!', intents=intents, member_cache_flags=member_cache_flags,
+                chunk_guilds_at_startup=chunk_guilds_at_startup, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+bot.remove_command('help')
+bot.add_cog(Music(bot))
+
+link = bot.add_store(ClusterLink(bot, os.environ.get('IPC_ADDRESS'),
+                                 cluster_id=CLUSTER_ID or 0,
+                                 cluster_count=int(os.environ.get('CLUSTER_COUNT', 1)),
+                                 shard_count=SHARD_COUNT or 1))
+metrics_address = os.environ.get('METRICS_ADDRESS', '127.0.0.1:9100')
+if metrics_address and CLUSTER_ID:
+    # One port per cluster on the same machine.
+    host, port = metrics_address.rsplit(':', 1)
+    metrics_address = '{}:{}'.format(host, int(port) + CLUSTER_ID)
+metrics = bot.add_store(Metrics(bot, metrics_address or None))
+watchdog = bot.add_store(LoopWatchdog(float(os.environ.get('SLOW_CALLBACK_MS', 100)) / 1000))
+bot.add_store(YTDLSource.engine)
+audio_cache = bot.add_store(AudioCache(data_path(os.environ.get('AUDIO_CACHE_DIR', 'audio_cache')),
+                                       max_bytes=int(os.environ.get('AUDIO_CACHE_MB', 0)) * 1024 * 1024,
+                                       min_plays=int(os.environ.get('AUDIO_CACHE_MIN_PLAYS', 3))))
+
+# Wallets and cooldowns belong to users, not guilds, so one cluster keeps them for everyone.
+if (CLUSTER_ID or 0) == 0:
+    economy = SharedStore(link, 'economy', EconomyStore.SHARED_METHODS, bot.add_store(EconomyStore('economy.json')))
+    cooldowns = SharedStore(link, 'cooldowns', CooldownStore.SHARED_METHODS,
+                            bot.add_store(CooldownStore('cooldowns.json')))
+else:
+    economy = SharedStore(link, 'economy', EconomyStore.SHARED_METHODS)
+    cooldowns = SharedStore(link, 'cooldowns', CooldownStore.SHARED_METHODS)
+
+scheduler = bot.add_store(ActionScheduler(bot, data_path('scheduled_actions.json')))
+player_store = bot.add_store(PlayerStore(bot, data_path('player_state.json')))
+settings = bot.add_store(GuildSettings(bot, data_path('guild_settings.json'), default={
+    '787791032745590845': {
+        'log_channel': 850100716559400960,
+        'mute_role': 850033230341341244,
+        'join_role': 850027060864352266,
+        'temp_lobby': 850728985854738440,
+        'temp_category': 850021698472247346,
+        'moderator': 709725675711496233,
+    },
+}))
+temp_channels = bot.add_store(TempChannelManager(bot, data_path('temp_channels.json'), settings=settings))
+reaction_roles = bot.add_store(ReactionRoles(bot, data_path('reaction_roles.json'), default=[
+    {'guild': 787791032745590845, 'message': 850785149519527976, 'emoji': '💜', 'role': 793859329672347679},
+]))
+
+@bot.command()
+async def say(ctx, *, msg: str = None):
+  await ctx.send(embed = discord.Embed(description = msg))
+    
+#Clear Chat
+@bot.command( pass_context = True )
+
+async def clear( ctx, amount = 100 ):
+    await ctx.channel.purge( limit = amount )
+
+@bot.event
+async def on_member_join( member ):
+    channel = settings.channel( member.guild, 'log_channel' )
+
+    role = settings.role( member.guild, 'join_role' )
+
+    if role is not None:
+        await member.add_roles( role )
+    if channel is not None:
+        await channel.send( embed = discord.Embed(description = f'Пользователь ``{ member.name }``, присоединился к нам!',
+         color = 0x0c0c0c ) )
+
+@bot.command( pass_context = True )
+
+async def help( ctx ):
+    emb = discord.Embed( title = 'Навигация по командам' )
+
+    emb.add_field( name = '{}play'.format( '!' ), value = 'Включить музыку' )
+    emb.add_field( name = '{}stop'.format( '!' ), value = 'Выключить музыку' )
+    emb.add_field( name = '{}skip'.format( '!' ), value = 'Пропустить музыку' )
+    emb.add_field( name = '{}cum'.format( '!' ), value = 'Что-то интересное в 18+ канале' )
+    emb.add_field( name = '{}info'.format( '!' ), value = 'Узнать информацию о пользователе' )
+
+    await ctx.send( embed = emb )
+
+@bot.event
+async def on_voice_state_update(member,before,after):
+    await temp_channels.on_voice_state_update(member, before, after)
+
+@bot.command()
+@persistent_cooldown(12*60)
+async def timely(ctx):
+    await economy.credit(ctx.author.id, 1250)
+    emb = discord.Embed(description=f'**{ctx.author}** Вы получили свои 1250 монет')
+    await ctx.send(embed= emb)
+@timely.error
+async def timely_error(ctx, error):
+    if not isinstance(error, CooldownActive):
+        raise error
+    emb = discord.Embed(description=f'**{ctx.author}** Вы уже получили свою награду')
+    await ctx.send(embed= emb)
+@bot.command()
+async def balance(ctx,member:discord.Member = None):
+    member = member or ctx.author
+    emb = discord.Embed(description=f'У **{member}** {await economy.balance(member.id)} монет')
+    await ctx.send(embed= emb)
+@bot.command()
+async def addshop(ctx,role:discord.Role,cost:int):
+    if cost < 0:
+        return await ctx.send('Цена не может быть меньше нуля')
+    if await economy.add_shop_item(role.id, cost):
+        await ctx.send('Роль добавлена в магазин')
+    else:
+        await ctx.send("Эта роль уже есть в магазине")
+@bot.command()
+async def shop(ctx):
+    emb = discord.Embed(title="Магазин")
+    for role, item in (await economy.shop_items()).items():
+        emb.add_field(name=f'Цена: {item["Cost"]}',value=f'<@&{role}>',inline=False)
+    await ctx.send(embed=emb)
+@bot.command()
+async def removeshop(ctx,role:discord.Role):
+    if await economy.remove_shop_item(role.id):
+        await ctx.send('Роль удалена из магазина')
+    else:
+        await ctx.send("Этой роли нет в магазине")
+@bot.command()
+async def buy(ctx,role:discord.Role):
+    cost = await economy.shop_cost(role.id)
+    if cost is None:
+        return
+    # Roles belong to a guild and a guild to one cluster, so a local lock is enough.
+    async with economy.lock(ctx.author.id):
+        if role in ctx.author.roles:
+            await ctx.send('У вас уже есть эта роль!')
+        elif await economy.purchase(ctx.author.id, role.id):
+            await ctx.send('Вы купили роль!')
+            try:
+                await ctx.author.add_roles(role)
+            except discord.HTTPException:
+                # Nothing was bought after all, give the coins back.
+                if cost:
+                    await economy.credit(ctx.author.id, cost)
+                raise
+
+@bot.command()
+async def give(ctx,member:discord.Member,arg:int):
+    if arg <= 0:
+        return await ctx.send('Можно подарить только больше нуля монет')
+    if await economy.transfer(ctx.author.id, member.id, arg):
+        emb = discord.Embed(description=f'**{ctx.author}** подарил **{member}** **{arg}** монет')
+        await ctx.send(embed = emb)
+    else:
+        await ctx.send('У вас недостаточно денег')
+
+# (guild id, page) -> (page version, embed); names are resolved per guild.
+top_pages = TTLCache(maxsize=1024, ttl=10 * 60)
+
+@bot.command()
+@commands.guild_only()
+async def top(ctx,page:int = 1):
+    page, version = await economy.leaderboard_page(page)
+    cached = top_pages.get((ctx.guild.id, page))
+    if cached is None or cached[0] != version:
+        emb = discord.Embed(title="Самые богатые")
+        lines = []
+        for place, (user_id, money) in enumerate(await economy.top(10, (page - 1) * 10), start=(page - 1) * 10 + 1):
+            member = ctx.guild.get_member(user_id)
+            lines.append(f'`{place}.` {member.display_name if member else f"<@{user_id}>"} — {money} монет')
+        emb.description = '\n'.join(lines) or 'Здесь пока никого нет'
+        emb.set_footer(text=f'Страница {page}')
+        cached = (version, emb)
+        top_pages.put((ctx.guild.id, page), cached)
+    await ctx.send(embed=cached[1])
+
+@bot.command()
+async def rank(ctx,member:discord.Member = None):
+    member = member or ctx.author
+    found = await economy.rank(member.id)
+    if found is None:
+        return await ctx.send(f'У **{member}** ещё нет кошелька')
+    place, money, total = found
+    emb = discord.Embed(description=f'**{member}** на **{place}** месте из {total} с {money} монет')
+    await ctx.send(embed=emb)
+
+@bot.event
+async def on_raw_reaction_add(payload):
+    await reaction_roles.on_reaction_add(payload)
+
+@bot.event
+async def on_raw_reaction_remove(payload):
+    await reaction_roles.on_reaction_remove(payload)
+
+@bot.command()
+@commands.has_permissions(manage_roles=True)
+async def addreactionrole(ctx,message_id:int,emoji:str,role:discord.Role):
+    reaction_roles.bind(ctx.guild.id, message_id, emoji, role.id)
+    await ctx.send(f'Теперь за {emoji} на сообщении {message_id} выдаётся роль {role.mention}')
+@bot.command()
+@commands.has_permissions(manage_roles=True)
+async def removereactionrole(ctx,message_id:int,emoji:str):
+    if reaction_roles.unbind(message_id, emoji):
+        await ctx.send('Роль за реакцию удалена')
+    else:
+        await ctx.send('Такой роли за реакцию нет')
+@bot.command()
+@commands.has_permissions(manage_roles=True)
+async def reactionroles(ctx):
+    emb = discord.Embed(title="Роли за реакции")
+    for binding in reaction_roles.bindings(ctx.guild.id):
+        emb.add_field(name=f'{binding["emoji"]} на {binding["message"]}',value=f'<@&{binding["role"]}>',inline=False)
+    await ctx.send(embed=emb)
+
+@bot.command()
+@commands.has_permissions(view_audit_log=True)
+async def mute(ctx,member:discord.Member,time:int,reason):
+    role = settings.role(ctx.guild, 'mute_role')
+    if role is None:
+        return await ctx.send('Роль мута не настроена: !setconfig mute_role <id>')
+    channel = settings.channel(ctx.guild, 'log_channel')
+    await member.add_roles(role)
+    emb = discord.Embed(title="Мут",color=0x2f3136)
+    emb.add_field(name='Модератор',value=ctx.message.author.mention,inline=False)
+    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
+    emb.add_field(name='Причина',value=reason,inline=False)
+    emb.add_field(name="Время",value=time,inline=False)
+    if channel is not None:
+        await channel.send(embed = emb)
+    scheduler.schedule('unmute', f'{ctx.guild.id}:{member.id}', time*60,
+                       guild=ctx.guild.id, member=member.id, role=role.id)
+
+@scheduler.handler('unmute')
+async def expire_mute(action):
+    guild = bot.get_guild(action['guild'])
+    if guild is None:
+        return
+    # After a restart the lazy member cache won't have them yet.
+    member = await bot.get_or_fetch_member(guild, action['member'])
+    role = guild.get_role(action['role'])
+    # Actions saved before the settings existed carry their log channel.
+    channel = guild.get_channel(action['channel']) if 'channel' in action else settings.channel(guild, 'log_channel')
+    if channel is not None:
+        moderator = settings.get(guild.id, 'moderator')
+        emb = discord.Embed(title="Анмут",color=0x2f3136)
+        emb.add_field(name='Модератор',value=f'<@{moderator}>' if moderator else bot.user.mention,inline=False)
+        emb.add_field(name='Нарушитель',value=f'<@{action["member"]}>',inline=False)
+        emb.add_field(name='Причина',value="Время мута вышло",inline=False)
+        await channel.send(embed=emb)
+    if member is not None and role is not None:
+        await member.remove_roles(role)
+
+@bot.command()
+@commands.has_permissions(view_audit_log=True)
+async def unmute(ctx,member:discord.Member):
+    channel = settings.channel(ctx.guild, 'log_channel')
+    muterole = settings.role(ctx.guild, 'mute_role')
+    if muterole is None:
+        return await ctx.send('Роль мута не настроена: !setconfig mute_role <id>')
+    scheduler.cancel('unmute', f'{ctx.guild.id}:{member.id}')
+    emb = discord.Embed(title="Анмут",color=0xff0000)
+    emb.add_field(name='Модератор',value=ctx.message.author.mention,inline=False)
+    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
+    if channel is not None:
+        await channel.send(embed = emb)
+    await member.remove_roles(muterole)
+
+@bot.command()
+@commands.has_permissions(view_audit_log=True)
+async def kick(ctx,member:discord.Member,reason):
+    channel = settings.channel(ctx.guild, 'log_channel')
+    emb = discord.Embed(title="Кик",color=0xff0000)
+    emb.add_field(name='Модератор',value=ctx.message.author.mention,inline=False)
+    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
+    emb.add_field(name='Причина',value=reason,inline=False)
+    await member.kick()
+    if channel is not None:
+        await channel.send(embed = emb)
+
+@bot.command()
+@commands.has_permissions(view_audit_log=True)
+async def ban(ctx,member:discord.Member,reason):
+    channel = settings.channel(ctx.guild, 'log_channel')
+    emb = discord.Embed(title="Кик",color=0xff0000)
+    emb.add_field(name='Модератор',value=ctx.message.author.mention,inline=False)
+    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
+    emb.add_field(name='Причина',value=reason,inline=False)
+    await member.ban()
+    if channel is not None:
+        await channel.send(embed = emb)
+
+@bot.command()
+@commands.has_permissions(view_audit_log=True)
+async def tempban(ctx,member:discord.Member,time:int,reason):
+    channel = settings.channel(ctx.guild, 'log_channel')
+    emb = discord.Embed(title="Бан",color=0xff0000)
+    emb.add_field(name='Модератор',value=ctx.message.author.mention,inline=False)
+    emb.add_field(name='Нарушитель',value=member.mention,inline=False)
+    emb.add_field(name='Причина',value=reason,inline=False)
+    emb.add_field(name="Время",value=time,inline=False)
+    await member.ban(reason=reason)
+    if channel is not None:
+        await channel.send(embed = emb)
+    scheduler.schedule('unban', f'{ctx.guild.id}:{member.id}', time*60,
+                       guild=ctx.guild.id, member=member.id)
+
+@scheduler.handler('unban')
+async def expire_ban(action):
+    guild = bot.get_guild(action['guild'])
+    if guild is None:
+        return
+    try:
+        await guild.unban(discord.Object(id=action['member']), reason='Время бана вышло')
+    except discord.NotFound:
+        return
+    channel = guild.get_channel(action['channel']) if 'channel' in action else settings.channel(guild, 'log_channel')
+    if channel is not None:
+        emb = discord.Embed(title="Разбан",color=0x2f3136)
+        emb.add_field(name='Нарушитель',value=f'<@{action["member"]}>',inline=False)
+        emb.add_field(name='Причина',value="Время бана вышло",inline=False)
+        await channel.send(embed=emb)
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def config(ctx):
+    emb = discord.Embed(title="Настройки сервера")
+    values = settings.all(ctx.guild.id)
+    for key, description in settings.KEYS.items():
+        emb.add_field(name=f'{key} — {description}',value=values.get(key, 'не задано'),inline=False)
+    await ctx.send(embed=emb)
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def setconfig(ctx,key:str,value:int = None):
+    try:
+        settings.set(ctx.guild.id, key, value)
+    except KeyError:
+        return await ctx.send('Нет такой настройки. Доступные: ' + ', '.join(settings.KEYS))
+    await ctx.send(f'{key} = {value if value is not None else "не задано"}')
+
+@bot.command()
+@commands.has_permissions(administrator=True)
+async def reloadconfig(ctx):
+    try:
+        await settings.reload()
+    except (OSError, ValueError) as e:
+        return await ctx.send(f'Не удалось перечитать настройки: {e}')
+    await ctx.send('Настройки перечитаны')
+
+@bot.command()
+async def info(ctx,member:discord.Member):
+    emb = discord.Embed(title='Информация о пользователе',color=0xff0000)
+    emb.add_field(name="Когда присоединился:",value=member.joined_at,inline=False)
+    emb.add_field(name='Имя:',value=member.display_name,inline=False)
+    emb.add_field(name='Айди:',value=member.id,inline=False)
+    emb.add_field(name="Аккаунт был создан:",value=member.created_at.strftime("%a,%#d %B %Y, %I:%M %p UTC"),inline=False)
+    emb.set_thumbnail(url=member.avatar_url)
+    emb.set_footer(text=f"Вызвано:{ctx.message.author}",icon_url=ctx.message.author.avatar_url)
+    emb.set_author(name=ctx.message.author,icon_url=ctx.message.author.avatar_url)
+    await ctx.send(embed = emb)
+
+Arguments = ['feet', 'yuri', 'trap', 'futanari', 'hololewd', 'lewdkemo', 'solog', 'feetg', 'cum', 'erokemo', 'les', 'wallpaper', 'lewdk', 'ngif', 'tickle', 'lewd', 'feed', 'gecg', 'eroyuri', 'eron', 'cum_jpg', 'bj', 'nsfw_neko_gif', 'solo', 'kemonomimi', 'nsfw_avatar', 'gasm', 'poke', 'anal', 'slap', 'hentai', 'avatar', 'erofeet', 'holo', 'keta', 'blowjob', 'pussy', 'tits', 'holoero', 'lizard', 'pussy_jpg', 'pwankg', 'classic', 'kuni', 'waifu', 'pat', '8ball', 'kiss', 'femdom', 'neko', 'spank', 'cuddle', 'erok', 'fox_girl', 'boobs', 'random_hentai_gif', 'smallboobs', 'hug', 'ero', 'smug', 'goose', 'baka', 'woof']
+def is_nsfw():
+    async def predicate(ctx):
+        return ctx.channel.is_nsfw()
+    return commands.check(predicate)
+
+IMAGE_PROVIDERS = {'nekos': NekosLifeProvider, 'stub': StubProvider}
+images = bot.add_store(ImageBuffer(IMAGE_PROVIDERS[os.environ.get('IMAGE_PROVIDER', 'nekos')](), Arguments,
+                                   size=int(os.environ.get('IMAGE_BUFFER', 5)), prefetch=['cum']))
+
+@bot.command()
+@is_nsfw()
+async def cum(ctx):
+    try:
+        url = await images.get('cum')
+    except ImageError:
+        return await ctx.send('Не удалось получить картинку, попробуйте позже')
+    emb = discord.Embed(color=0xebebeb)
+    emb.set_image(url=url)
+    await ctx.send(embed=emb)
+
+@metrics.gauge('racingbot_music', 'Voice states, running players, queued songs and ffmpeg processes.')
+def music_gauge():
+    stats = bot.get_cog('Music').stats()
+    return {(('kind', kind),): stats[kind] for kind in ('voice_states', 'players', 'queued_songs', 'ffmpeg_processes')}
+
+@metrics.gauge('racingbot_extraction_jobs', 'youtube-dl jobs running in the extraction pool or waiting for it.')
+def extraction_gauge():
+    stats = YTDLSource.engine.stats()
+    return {(('state', 'running'),): stats['active'], (('state', 'waiting'),): stats['pending']}
+
+@metrics.gauge('racingbot_executor_jobs', 'Jobs in the event loop\'s default executor.')
+def executor_gauge():
+    return {(('state', 'running'),): metrics.executor.running, (('state', 'waiting'),): metrics.executor.queued}
+
+@metrics.gauge('racingbot_cache_lookups', 'Cache hits and misses since startup.')
+def cache_gauge():
+    ytdl = YTDLSource.cache_stats()
+    values = {}
+    for cache, stats in (('search', ytdl['search']), ('info', ytdl['info']), ('images', images.stats())):
+        values[(('cache', cache), ('result', 'hit'))] = stats['hits']
+        values[(('cache', cache), ('result', 'miss'))] = stats['misses']
+    values[(('cache', 'audio'), ('result', 'hit'))] = audio_cache.hits
+    return values
+
+@metrics.gauge('racingbot_gateway_latency_seconds', 'Heartbeat latency per shard.')
+def latency_gauge():
+    return {(('shard', shard),): latency for shard, latency in bot.latencies if not math.isnan(latency)}
+
+@metrics.gauge('racingbot_guilds', 'Guilds this process receives events for.')
+def guilds_gauge():
+    return len(bot.guilds)
+
+@metrics.gauge('racingbot_tasks', 'Asyncio tasks alive in this process.')
+def tasks_gauge():
+    return len(asyncio.all_tasks(bot.loop))
+
+@metrics.gauge('racingbot_loop_stalls', 'Times the event loop was blocked for longer than SLOW_CALLBACK_MS.')
+def stalls_gauge():
+    return watchdog.total
+
+@link.handler('stats')
+async def cluster_stats():
+    return {
+        'cluster': link.cluster_id,
+        'shards': sorted(bot.shards),
+        'guilds': len(bot.guilds),
+        'players': bot.get_cog('Music').stats()['players'],
+        'latency_ms': None if math.isnan(bot.latency) else round(bot.latency * 1000),
+    }
+
+@link.handler('guild')
+async def cluster_guild(guild_id):
+    guild = bot.get_guild(guild_id)
+    if guild is None:
+        return None
+    return {'cluster': link.cluster_id, 'shard': guild.shard_id, 'name': guild.name, 'members': guild.member_count}
+
+@bot.command()
+@commands.is_owner()
+async def clusters(ctx,guild_id:int = None):
+    if guild_id is not None:
+        found = await link.request(link.cluster_of(guild_id), 'guild', guild_id=guild_id)
+        return await ctx.send(f'```json\n{json.dumps(found, indent=2, ensure_ascii=False)}\n```')
+    emb = discord.Embed(title="Кластеры")
+    for stats in await link.broadcast('stats'):
+        emb.add_field(name=f'Кластер {stats["cluster"]}',
+                      value=f'Шарды: {stats["shards"]}\nСерверы: {stats["guilds"]}\nПлееры: {stats["players"]}\n'
+                            f'Пинг: {stats["latency_ms"]} мс',inline=False)
+    await ctx.send(embed=emb)
+
+@bot.command()
+@commands.is_owner()
+async def stalls(ctx,count:int = 10):
+    if not watchdog.stalls:
+        return await ctx.send(f'Цикл событий не блокировался дольше {watchdog.threshold * 1000:.0f} мс')
+    report = watchdog.report(count)
+    await ctx.send(f'Блокировок всего: {watchdog.total}, последние {min(count, len(watchdog.stalls))}:',
+                   file=discord.File(io.BytesIO(report.encode()), filename='stalls.txt'))
+
+# Only one profiler at a time; two would sample each other's overhead.
+profiling = asyncio.Lock()
+
+@bot.command()
+@commands.is_owner()
+async def profile(ctx,seconds:float = 10,threads:str = 'loop'):
+    if not 0 < seconds <= 300:
+        return await ctx.send('Профилировать можно от 0 до 300 секунд')
+    if profiling.locked():
+        return await ctx.send('Профилировщик уже запущен')
+    async with profiling:
+        await ctx.send(f'Собираю стеки {seconds:g} с...')
+        profiler = SamplingProfiler(threads=None if threads == 'all' else {threading.get_ident()})
+        await bot.loop.run_in_executor(None, profiler.run, seconds)
+    top = '\n'.join(f'{share:6.1%} {name}' for name, share in profiler.top())
+    await ctx.send(f'Срезов: {profiler.samples}\n```\n{top}\n```',
+                   file=discord.File(io.BytesIO(profiler.collapsed().encode()), filename='profile.collapsed'))
+
+@bot.event
+async def on_ready():
+    print('Logged in as:\n{0.user.name}\n{0.user.id}'.format(bot))
+    print('Startup: {}'.format(bot.report_startup()))
+
+    await bot.change_presence(activity=discord.Activity(type=discord.ActivityType.watching, name="в твоё сердце"))
+
+if __name__ == '__main__':
+    bot.run("ODUwNzIwOTI1NTYwODY0Nzg4.YLt1mg.vUb3gTNkZZR846yCZpSrmWs9dU8")
+
@@ -0,0 +1,215 @@
+"""Runs the bot as several processes, each connecting a share of the shards.
+
+The launcher asks Discord how many shards the bot should have (or takes
+``--shards``), splits them into ``--clusters`` contiguous ranges and
+starts one ``bot.py`` per range. A cluster that exits is started again.
+
+It also hosts the link the clusters talk through: every cluster keeps
+one connection to the launcher and sends JSON lines over it. A request
+goes to one cluster, or to all of them with ``"to": "all"``, and the
+launcher sends the answer (a list of answers for ``all``) back to the
+cluster that asked.
+
+    python cluster.py --clusters 4
+
+Without the launcher ``python bot.py`` keeps running every shard in one
+process, as before.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import os
+import signal
+import sys
+
+import aiohttp
+
+log = logging.getLogger('racingbot.cluster')
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def shard_ids(cluster: int, clusters: int, shards: int):
+    """The shards a cluster connects; together the clusters cover every shard once."""
+
+    return list(range(cluster * shards // clusters, (cluster + 1) * shards // clusters))
+
+
+def cluster_of(guild_id: int, clusters: int, shards: int) -> int:
+    """The cluster that receives a guild's events."""
+
+    shard = (guild_id >> 22) % shards
+    for cluster in range(clusters):
+        if shard < (cluster + 1) * shards // clusters:
+            return cluster
+    raise ValueError(shard)
+
+
+async def read_message(reader: asyncio.StreamReader):
+    line = await reader.readline()
+    if not line:
+        raise ConnectionResetError('Connection closed')
+    return json.loads(line)
+
+
+def write_message(writer: asyncio.StreamWriter, message: dict):
+    writer.write(json.dumps(message).encode() + b'\n')
+
+
+async def recommended_shards(token: str) -> int:
+    async with aiohttp.ClientSession() as session:
+        async with session.get('https://discord.com/api/v8/gateway/bot',
+                               headers={'Authorization': 'Bot ' + token}) as response:
+            response.raise_for_status()
+            return (await response.json())['shards']
+
+
+class Hub:
+    """Passes requests and answers between the clusters."""
+
+    def __init__(self):
+        self.clusters = {}
+        # hub id -> (asking cluster, its request id, clusters still to answer, answers, broadcast)
+        self._pending = {}
+        self._ids = itertools.count()
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        cluster = None
+        try:
+            hello = await read_message(reader)
+            cluster = hello['cluster']
+            self.clusters[cluster] = writer
+            log.info('Cluster %s connected', cluster)
+
+            while True:
+                message = await read_message(reader)
+                if message['op'] == 'request':
+                    self._forward(cluster, message)
+                elif message['op'] == 'response':
+                    self._answer(message['id'], cluster, message)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            if cluster is not None and self.clusters.get(cluster) is writer:
+                del self.clusters[cluster]
+                log.info('Cluster %s disconnected', cluster)
+                for hub_id, pending in list(self._pending.items()):
+                    if cluster in pending[2]:
+                        self._answer(hub_id, cluster, {'error': 'Cluster {} disconnected'.format(cluster)})
+            writer.close()
+
+    def _forward(self, origin: int, message: dict):
+        targets = list(self.clusters) if message['to'] == 'all' else [message['to']]
+        hub_id = next(self._ids)
+        self._pending[hub_id] = (origin, message['id'], set(targets), {}, message['to'] == 'all')
+
+        for target in targets:
+            writer = self.clusters.get(target)
+            if writer is None:
+                self._answer(hub_id, target, {'error': 'Cluster {} is not connected'.format(target)})
+            else:
+                write_message(writer, {'op': 'request', 'id': hub_id, 'method': message['method'],
+                                       'args': message['args']})
+
+    def _answer(self, hub_id: int, cluster: int, message: dict):
+        pending = self._pending.get(hub_id)
+        if pending is None:
+            return
+
+        origin, request_id, waiting, answers, broadcast = pending
+        waiting.discard(cluster)
+        answers[cluster] = message
+        if waiting:
+            return
+
+        del self._pending[hub_id]
+        writer = self.clusters.get(origin)
+        if writer is None:
+            return
+
+        if broadcast:
+            # Clusters that failed are left out of a broadcast.
+            result = [answer['result'] for _, answer in sorted(answers.items()) if 'error' not in answer]
+            write_message(writer, {'op': 'response', 'id': request_id, 'result': result})
+        else:
+            answer = answers[cluster]
+            write_message(writer, dict(answer, op='response', id=request_id))
+
+
+class Launcher:
+    def __init__(self, *, clusters: int, shards: int, address: str, restart_delay: float = 5):
+        self.clusters = clusters
+        self.shards = shards
+        self.address = address
+        self.restart_delay = restart_delay
+        self.processes = {}
+        self.stopping = False
+
+    async def run_cluster(self, cluster: int):
+        env = dict(os.environ,
+                   CLUSTER_ID=str(cluster),
+                   CLUSTER_COUNT=str(self.clusters),
+                   SHARD_COUNT=str(self.shards),
+                   SHARD_IDS=','.join(map(str, shard_ids(cluster, self.clusters, self.shards))),
+                   IPC_ADDRESS=self.address)
+
+        while not self.stopping:
+            process = await asyncio.create_subprocess_exec(sys.executable, os.path.join(ROOT, 'bot.py'),
+                                                           cwd=ROOT, env=env)
+            self.processes[cluster] = process
+            log.info('Cluster %s started with shards %s', cluster, env['SHARD_IDS'])
+
+            code = await process.wait()
+            if self.stopping:
+                break
+            log.warning('Cluster %s exited with %s, restarting in %ss', cluster, code, self.restart_delay)
+            await asyncio.sleep(self.restart_delay)
+
+    def stop(self):
+        self.stopping = True
+        for process in self.processes.values():
+            if process.returncode is None:
+                process.terminate()
+
+    async def run(self):
+        host, port = self.address.rsplit(':', 1)
+        hub = Hub()
+        server = await asyncio.start_server(hub.serve, host, int(port))
+
+        loop = asyncio.get_event_loop()
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(signum, self.stop)
+
+        async with server:
+            await asyncio.gather(*(self.run_cluster(cluster) for cluster in range(self.clusters)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--clusters', type=int, default=int(os.environ.get('CLUSTERS', 2)))
+    parser.add_argument('--shards', type=int, default=int(os.environ.get('SHARD_COUNT', 0)),
+                        help='defaults to the number Discord recommends')
+    parser.add_argument('--address', default=os.environ.get('IPC_ADDRESS', '127.0.0.1:8765'))
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    shards = args.shards
+    if not shards:
+        token = os.environ.get('DISCORD_TOKEN')
+        if token is None:
+            with open(os.path.join(ROOT, 'token.txt')) as f:
+                token = f.read().strip()
+        shards = asyncio.get_event_loop().run_until_complete(recommended_shards(token))
+
+    clusters = min(args.clusters, shards)
+    log.info('Running %d shards in %d clusters', shards, clusters)
+    launcher = Launcher(clusters=clusters, shards=shards, address=args.address)
+    asyncio.get_event_loop().run_until_complete(launcher.run())
+
+
+if __name__ == '__main__':
+    main()